@@ -1,4 +1,5 @@
 import os
+import sys
 from functools import partial
 
 import xbmc
@@ -8,12 +9,18 @@ import xbmcgui
 from resources.lib import foscam
 from resources.lib import utils
 from resources.lib import gui
+from resources.lib import workers
+from resources.lib import devicestate
+from resources.lib import ptz
 
 
-user = utils.get_setting('username')
-password = utils.get_setting('password')
-host = utils.get_setting('host')
-port = utils.get_int_setting('port')
+try:
+    camera_index = int(sys.argv[1])
+except (IndexError, ValueError):
+    camera_index = 1
+
+camera_settings = utils.get_camera_settings(camera_index) or utils.get_camera_settings(1)
+host, port, user, password = camera_settings
 
 if not host:
     utils.error_dialog(utils.get_string(32101))
@@ -26,18 +33,33 @@ if utils.invalid_password_char(password, show_dialog=True):
     sys.exit(1)
 
 camera = foscam.Camera(host, port, user, password)
-success, msg = camera.test()
-if not success:
-    utils.error_dialog(msg)
-    sys.exit(1)
+device_state = devicestate.DeviceStateStore(
+    os.path.join(xbmc.translatePath(utils.addon_info('profile')), "device_state.json"))
+device_state.load(camera)
+
+# The camera is tested and its state read while the player starts,
+# and the dialog is shown from the last known state in the meantime
+pool = workers.WorkerPool(3, name="camera")
+connection_test = pool.submit(camera.test)
+mirror_and_flip = pool.submit(camera.get_mirror_and_flip)
+
+
+def command_failed(response):
+    message = response.message if response is not False else utils.get_string(32107)
+    utils.notify(u"{0}: {1}".format(utils.get_string(32103), message))
+
+
+# Commands are sent from other threads so that the dialog never waits for the camera
+ptz_controller = ptz.PTZController(camera, on_error=command_failed)
+ptz_controller.start()
 
 
 class MoveButton(gui.Button):
     def __init__(self, parent, direction, x, y):
-        self.cmd = partial(camera.move, direction)
+        self.cmd = partial(ptz_controller.move, direction)
 
     def send_cmd(self, control=None):
-        return self.cmd()
+        self.cmd()
 
 
 class MirrorFlipButton(gui.ToggleButton):
@@ -45,7 +67,13 @@ class MirrorFlipButton(gui.ToggleButton):
         self.cmd = partial(camera.toggle_mirror_flip, action)
 
     def send_cmd(self, control=None):
-        return self.cmd(control.isSelected())
+        pool.submit(self.toggle, control, control.isSelected())
+
+    def toggle(self, control, enable):
+        response = self.cmd(enable)
+        if not response:
+            command_failed(response)
+            control.setSelected(not enable)
   
 
 class CameraControlDialog(xbmcgui.WindowDialog):
@@ -56,13 +84,27 @@ class CameraControlDialog(xbmcgui.WindowDialog):
         utils.log_normal("Starting main view")
         self.playVideo()
         self.setupUi()
+        self.show_mirror_and_flip(camera.get_mirror_and_flip(fetch=False))
+        pool.submit(self.update_state)
 
-        mirror, flip = camera.get_mirror_and_flip()
+        self.doModal()
 
-        self.mirror_button.setSelected(mirror)
-        self.flip_button.setSelected(flip)
+    def update_state(self):
+        ''' Shows the state read from the camera, or closes the dialog if the camera could not be reached '''
+        success, msg = connection_test.result()
+        if not success:
+            utils.error_dialog(msg)
+            self.stop()
+            return
 
-        self.doModal()
+        self.show_mirror_and_flip(mirror_and_flip.result())
+        device_state.save(camera)
+
+    def show_mirror_and_flip(self, mirror_and_flip):
+        if mirror_and_flip is not None:
+            mirror, flip = mirror_and_flip
+            self.mirror_button.setSelected(mirror)
+            self.flip_button.setSelected(flip)
 
     def playVideo(self):
         self.player = utils.StopResumePlayer()
@@ -134,14 +176,7 @@ class CameraControlDialog(xbmcgui.WindowDialog):
         elif control == self.settings_button:
             utils.open_settings()
         else:
-            button = self.getControl(control)
-            response = button.send_cmd(control)
-            if not response:
-                msg = u"{0}: {1}".format(utils.get_string(32103), response.message)
-                utils.notify(msg)
-
-                if isinstance(control, xbmcgui.ControlRadioButton):
-                    control.setSelected(not control.isSelected())
+            self.getControl(control).send_cmd(control)
 
     def onAction(self, action):
         if action in (utils.ACTION_PREVIOUS_MENU, utils.ACTION_BACKSPACE,
@@ -150,6 +185,7 @@ class CameraControlDialog(xbmcgui.WindowDialog):
 
     def stop(self):
         utils.log_normal("Closing main view")
+        ptz_controller.halt()
         self.player.stop()
         self.close()
         self.player.maybe_resume_previous()
@@ -160,5 +196,11 @@ class CameraControlDialog(xbmcgui.WindowDialog):
 with CameraControlDialog() as camera_dialog:
     camera_dialog.start()
 
+# Let a camera which is still moving be stopped before the script ends
+ptz_controller.close()
+ptz_controller.join()
+pool.shutdown()
+device_state.save(camera)
+
             
             
@@ -0,0 +1,67 @@
+import threading
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+
+DEFAULT_PORT = 8089
+
+
+class _AlarmRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        camera = params.get('camera', [None])[0]
+
+        if self.server.on_alarm(camera, self.client_address[0]):
+            status, body = 200, b"OK\n"
+        else:
+            status, body = 404, b"Unknown camera\n"
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        self.server.log("{0} {1}".format(self.client_address[0], format % args))
+
+
+class AlarmListener(ThreadingMixIn, HTTPServer):
+    ''' A small HTTP server which receives alarm notifications from cameras.
+
+        The camera firmware is set up to request http://<kodi>:<port>/alarm?camera=<n>
+        when an alarm is triggered. Requests are not authenticated, so on_alarm, which is
+        called with the camera parameter (or None) and the client address, should only
+        accept a notification from the address of the camera it names. It returns whether
+        the camera is known. host limits the interfaces listened on; all are by default. '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port, on_alarm, host='', log=None):
+        HTTPServer.__init__(self, (host, port), _AlarmRequestHandler)
+        self.on_alarm = on_alarm
+        self.log = log or (lambda message: None)
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="alarm-listener")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,130 @@
+import re
+
+
+_ELEMENT_RE = re.compile(r'<(\w+)>([^<]*)</\1>')
+_INT_RE = re.compile(r'-?(0|[1-9][0-9]*)$')
+
+_ENTITY_RE = re.compile(r'&(?:#([0-9]+)|#x([0-9a-fA-F]+)|(lt|gt|quot|apos|amp));')
+_ENTITIES = {'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'", 'amp': '&'}
+
+try:
+    _chr = unichr
+except NameError:
+    _chr = chr
+
+
+def _replace_entity(match):
+    decimal, hexadecimal, name = match.groups()
+    if name:
+        return _ENTITIES[name]
+    try:
+        char = _chr(int(decimal, 10) if decimal else int(hexadecimal, 16))
+    except (ValueError, OverflowError):
+        return match.group(0)
+    # A byte string, as responses are on Python 2, is kept as UTF-8 bytes
+    return char.encode('utf-8') if isinstance(match.string, bytes) else char
+
+
+def unescape(text):
+    ''' Replaces the predefined XML entities and character references in one pass,
+        so that a decoded &amp; is never decoded again, without importing an XML library '''
+    return _ENTITY_RE.sub(_replace_entity, text)
+
+
+def typed_value(text):
+    ''' Converts the text of a response element to an int where it is one '''
+    if text is None:
+        return ''
+    if _INT_RE.match(text):
+        return int(text)
+    return text
+
+
+def parse_flat(xml):
+    ''' Returns the (tag, text) pairs of a flat <CGI_Result> document without building a tree,
+        or None if the document is not flat '''
+    elements = _ELEMENT_RE.findall(xml)
+    if not elements or xml.count('<') - xml.count('<?') != 2 * len(elements) + 2:
+        return None
+    return [(tag, unescape(text) if '&' in text else text) for tag, text in elements]
+
+
+def parse_tree(xml):
+    ''' Returns the (tag, text) pairs of the child elements of the document root '''
+    # Only needed for nested responses, so ElementTree is not imported with the module
+    import xml.etree.ElementTree as ET
+    return [(element.tag, element.text) for element in ET.fromstring(xml)]
+
+
+class CameraXMLResponse(object):
+    ''' A dictionary-like container which parses the XML response to a CGI request.
+
+        The response is parsed once into typed values, integers where possible and strings otherwise. '''
+
+    __slots__ = ('_keys', '_values', '_result_value')
+
+    RESULT_MSG = { 0: "Success",
+                  -1: "CGI request string format error",
+                  -2: "Username or password error",
+                  -3: "Access denied",
+                  -4: "CGI execute failure",
+                  -5: "Timeout"
+                  }
+
+    def __init__(self, response, flat=True):
+        xml = getattr(response, 'content', response)
+        if isinstance(xml, bytes) and not isinstance(xml, str):
+            xml = xml.decode('utf-8')
+
+        elements = parse_flat(xml) if flat else None
+        if elements is None:
+            elements = parse_tree(xml)
+
+        self._result_value = None
+        keys = []
+        self._values = {}
+        for tag, text in elements:
+            if tag == 'result':
+                self._result_value = int(text)
+            else:
+                keys.append(tag)
+                self._values[tag] = typed_value(text)
+        self._keys = tuple(keys)
+
+    def __nonzero__(self):
+        return self._result_value == 0
+
+    __bool__ = __nonzero__
+
+    def __str__(self):
+        return "result={0} {1}".format(self._result_value,
+                                       " ".join("{0}={1}".format(key, self._values[key])
+                                                for key in self._keys))
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    keys = __iter__
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def items(self):
+        return ((key, self._values[key]) for key in self._keys)
+
+    def values(self):
+        return (self._values[key] for key in self._keys)
+
+    @property
+    def status(self):
+        return self._result_value
+
+    @property
+    def message(self):
+        return self.RESULT_MSG.get(self._result_value, "Unknown error")
@@ -0,0 +1,80 @@
+import time
+import random
+import threading
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+FAILURE_THRESHOLD = 3
+MIN_RETRY = 5
+MAX_RETRY = 300
+JITTER = 0.2
+
+
+class CircuitBreaker(object):
+    ''' Tracks whether a camera can be reached, so that calls fail fast while it cannot.
+
+        The breaker is closed while calls succeed. After failure_threshold failures in
+        a row it opens, and calls are refused until a retry time has passed. Then it is
+        half-open, and a single probe call is let through: if it succeeds the breaker
+        closes, otherwise it opens again for twice as long, up to max_retry seconds,
+        with random jitter so that cameras which went down together are not all retried
+        at once. on_change is called with the old and new states and the retry delay
+        once for each change of state, rather than for every refused call. '''
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, min_retry=MIN_RETRY, max_retry=MAX_RETRY,
+                 on_change=None):
+        self.failure_threshold = failure_threshold
+        self.min_retry = min_retry
+        self.max_retry = max_retry
+        self.on_change = on_change or (lambda old, new, retry: None)
+
+        self.state = CLOSED
+        self.failures = 0
+        self.retry_time = 0
+
+        self._retry = 0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        ''' Whether a call would be let through now '''
+        with self._lock:
+            if self.state == OPEN:
+                return time.time() >= self.retry_time
+            return self.state == CLOSED
+
+    def allow(self):
+        ''' Returns whether a call may be made, letting one probe through once the retry time has passed '''
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN or time.time() < self.retry_time:
+                return False
+            self.state = HALF_OPEN
+        self.on_change(OPEN, HALF_OPEN, 0)
+        return True
+
+    def success(self):
+        with self._lock:
+            old = self.state
+            self.state = CLOSED
+            self.failures = 0
+            self._retry = 0
+        if old != CLOSED:
+            self.on_change(old, CLOSED, 0)
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            # A call which started before the breaker opened does not open it again
+            if self.state == OPEN or (self.state == CLOSED and self.failures < self.failure_threshold):
+                return
+            old = self.state
+            self._retry = min(self.max_retry, self._retry * 2 or self.min_retry)
+            retry = self._retry * (1 + JITTER * (2 * random.random() - 1))
+            self.retry_time = time.time() + retry
+            self.state = OPEN
+        self.on_change(old, OPEN, retry)
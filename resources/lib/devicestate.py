@@ -0,0 +1,53 @@
+import os
+import json
+import threading
+
+import fileutils
+
+
+def camera_key(camera):
+    return "{0}:{1}".format(camera.host, camera.port)
+
+
+class DeviceStateStore(object):
+    ''' Keeps the last known configs of each camera in a JSON file across runs.
+
+        Cameras are identified by their address and port. The configs are those
+        held in a camera's config cache, along with the times they were read, so a
+        loaded config is only treated as fresh for as long as it would have been.
+        Saving merges with the file, as the service and the control dialog share it. '''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.Lock()
+
+    def load(self, camera):
+        ''' Adds the stored configs of a camera to its cache and returns how many there were '''
+        configs = self._read().get(camera_key(camera), {})
+        camera.import_configs(configs)
+        return len(configs)
+
+    def save(self, camera):
+        with self._lock:
+            states = self._read()
+            configs = states.setdefault(camera_key(camera), {})
+            for get_cmd, (timestamp, config) in camera.export_configs().items():
+                if get_cmd not in configs or configs[get_cmd][0] <= timestamp:
+                    configs[get_cmd] = [timestamp, config]
+            self._write(states)
+
+    def _read(self):
+        try:
+            with open(self.filename) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, states):
+        path = os.path.dirname(self.filename)
+        if path and not os.path.isdir(path):
+            os.makedirs(path)
+        tmp = self.filename + ".tmp"
+        with open(tmp, 'w') as output:
+            json.dump(states, output, sort_keys=True)
+        fileutils.replace_file(tmp, self.filename)
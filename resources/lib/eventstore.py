@@ -0,0 +1,110 @@
+import os
+import time
+import sqlite3
+import threading
+
+
+PRUNE_BATCH = 500
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    camera TEXT NOT NULL,
+    time REAL NOT NULL,
+    kind TEXT,
+    duration INTEGER NOT NULL DEFAULT 0,
+    frame TEXT
+);
+CREATE INDEX IF NOT EXISTS events_camera_time ON events (camera, time);
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+'''
+
+COLUMNS = ('id', 'camera', 'time', 'kind', 'duration', 'frame')
+
+
+class EventStore(object):
+    ''' An append-only history of alarms in an SQLite database.
+
+        Each event has the camera, the time of the alarm, its kind if known ('motionDetect'
+        or 'sound'), how many seconds of preview were shown and the path of a key frame
+        from the preview. Events are indexed by camera and time, so the recent events of a
+        camera are found without reading the rest.
+
+        The store can be used from any thread. prune() deletes old events a batch at a
+        time, each in its own transaction, so adding an event never waits long for it. '''
+
+    def __init__(self, filename, batch_size=PRUNE_BATCH):
+        self.filename = filename
+        self.batch_size = batch_size
+
+        path = os.path.dirname(filename)
+        if path and not os.path.isdir(path):
+            os.makedirs(path)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(filename, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def add(self, camera, alarm_time, kind=None, duration=0, frame=None):
+        ''' Adds an event and returns its id '''
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO events (camera, time, kind, duration, frame) VALUES (?, ?, ?, ?, ?)",
+                (camera, alarm_time, kind, duration, frame))
+            return cursor.lastrowid
+
+    def events(self, camera=None, since=0, until=None, limit=None):
+        ''' Returns the events from since until the given time, newest first, as dictionaries '''
+        query = "SELECT {0} FROM events WHERE time >= ?".format(", ".join(COLUMNS))
+        params = [since]
+        if camera is not None:
+            query += " AND camera = ?"
+            params.append(camera)
+        if until is not None:
+            query += " AND time < ?"
+            params.append(until)
+        query += " ORDER BY time DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def recent(self, camera, seconds):
+        return self.events(camera, since=time.time() - seconds)
+
+    def prune_batch(self, before):
+        ''' Deletes up to batch_size events older than before, along with their key frames.
+            Returns how many were deleted. '''
+        with self._lock, self._connection:
+            rows = self._connection.execute(
+                "SELECT id, frame FROM events WHERE time < ? ORDER BY time LIMIT ?",
+                (before, self.batch_size)).fetchall()
+            self._connection.executemany("DELETE FROM events WHERE id = ?",
+                                         [(event_id,) for event_id, frame in rows])
+
+        for event_id, frame in rows:
+            if frame:
+                try:
+                    os.remove(frame)
+                except OSError:
+                    pass
+        return len(rows)
+
+    def prune(self, max_age, pause=0, stopped=None):
+        ''' Deletes the events older than max_age seconds in batches, pausing between them,
+            until there are none left or stopped returns True. Returns how many were deleted. '''
+        stopped = stopped or (lambda: False)
+        before = time.time() - max_age
+        total = 0
+        while True:
+            count = self.prune_batch(before)
+            total += count
+            if count < self.batch_size or stopped():
+                return total
+            time.sleep(pause)
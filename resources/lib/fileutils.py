@@ -0,0 +1,11 @@
+import os
+
+
+def replace_file(src, dst):
+    ''' Renames src over dst, so that readers of dst never see a partly written file '''
+    try:
+        os.rename(src, dst)
+    except OSError:
+        # Windows will not rename over an existing file
+        os.remove(dst)
+        os.rename(src, dst)
@@ -1,80 +1,152 @@
 import time
-import urllib
-import xml.etree.ElementTree as ET
+import socket
+import threading
+
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
 
 import requests
+from requests.adapters import HTTPAdapter
 
-import utils
+import host
+import mjpeg
+import circuitbreaker
+import requestscheduler
+from cgixml import CameraXMLResponse
+from metrics import registry as metrics
 
 
 ALARM_DURATION = 60
 
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+POOL_SIZE = 4
 
-class CameraXMLResponse(object):
-    ''' A dictionary-like container which parses the XML response to a CGI request '''
-
-    RESULT_MSG = { 0: "Success",
-                  -1: "CGI request string format error",
-                  -2: "Username or password error",
-                  -3: "Access denied",
-                  -4: "CGI execute failure",
-                  -5: "Timeout"
-                  }
+CONFIG_MAX_AGE = 300
 
-    def __init__(self, response):
-        self._xml = response.text
-        self._xml_root = ET.fromstring(self._xml)
+# Errors which show that the camera could not be reached, rather than that it answered badly
+UNREACHABLE_ERRORS = (requests.ConnectionError, requests.Timeout)
 
-        result = self._xml_root.find('result')
-        self._result_value = int(result.text)
-        self._xml_root.remove(result)
+# Sub stream resolutions from the smallest up as (value, width, height)
+SUB_STREAM_RESOLUTIONS = ((4, 320, 180),
+                          (3, 320, 240),
+                          (2, 640, 360),
+                          (1, 640, 480),
+                          (0, 1280, 720))
 
-    def __nonzero__(self):
-        return self._result_value == 0
-    
-    def __str__(self):
-        return self._xml
+SUB_STREAM_BIT_RATES = {4: 262144,
+                        3: 262144,
+                        2: 524288,
+                        1: 1048576,
+                        0: 2097152}
 
-    def __getitem__(self, key):
-        return int(self._xml_root.find(key).text)
+INTERACTIVE_COMMANDS = ('mirrorVideo', 'flipVideo', 'openInfraLed', 'closeInfraLed')
+POLL_COMMANDS = ('getDevState', 'snapPicture2')
 
-    def __iter__(self):
-        return (element.tag for element in self._xml_root)
 
-    keys = __iter__
+def command_priority(cmd):
+    ''' Returns the RequestScheduler priority of a command: controls first, then alarm polls, then configs '''
+    if cmd.startswith('ptz') or cmd in INTERACTIVE_COMMANDS:
+        return requestscheduler.INTERACTIVE
+    if cmd in POLL_COMMANDS:
+        return requestscheduler.POLL
+    return requestscheduler.CONFIG
 
-    def items(self):
-        return ((element.tag, int(element.text)) for element in self._xml_root)
 
-    def values(self):
-        return (int(element.text) for element in self._xml_root)
+def sub_stream_profile(width, height):
+    ''' Returns the resolution and bit rate of the smallest sub stream which covers the given size '''
+    for resolution, stream_width, stream_height in SUB_STREAM_RESOLUTIONS:
+        if stream_width >= width and stream_height >= height:
+            break
+    return resolution, SUB_STREAM_BIT_RATES[resolution]
 
-    @property
-    def status(self):
-        return self._result_value
 
-    @property
-    def message(self):
-        return self.RESULT_MSG[self._result_value]
+class SetConfigCommand(object):
+    ''' Changes some values of a camera config while keeping the others.
 
+        The current config is taken from the camera's cache if it is recent enough,
+        and nothing is sent if none of the values differ from it. '''
 
-class SetConfigCommand(object):
-    def __init__(self, camera, cmd):
+    def __init__(self, camera, cmd, max_age=CONFIG_MAX_AGE):
         self.camera = camera
         self.cmd = cmd
         
-        get_cmd = self.cmd.replace("set", "get")
-        self._config = dict(self.camera.send_command(get_cmd).items())
+        self.get_cmd = self.cmd.replace("set", "get")
+        self._current = self.camera.get_config(self.get_cmd, max_age)
+        self._config = dict(self._current or {})
 
     def __setitem__(self, key, value):
         self._config[key] = value
 
+    def changes(self):
+        return dict((key, value) for key, value in self._config.items()
+                    if self._current.get(key) != value)
+
     def send(self):
-        return self.camera.send_command(self.cmd, **self._config)
+        if self._current is None:
+            return False
+
+        changes = self.changes()
+        if not changes:
+            host.log_verbose("{0}: no changes", self.cmd)
+            return True
+
+        host.log_verbose("{0}: changing {1}", self.cmd, changes)
+        return self._send(self._config)
+
+    def restore(self):
+        ''' Sets the values which were changed by send back to what they were before '''
+        if self._current is None or not self.changes():
+            return True
+
+        host.log_verbose("{0}: restoring {1}", self.cmd, self._current)
+        return self._send(self._current)
+
+    def _send(self, config):
+        response = self.camera.send_command(self.cmd, **config)
+        if response:
+            self.camera.update_config(self.get_cmd, config)
+        else:
+            self.camera.invalidate_config(self.get_cmd)
+        return response
+
+
+def close_stream(response):
+    ''' Closes a streamed response. Its socket is shut down first, as only that
+        makes a read which is waiting for data in another thread return at once. '''
+    sock = _stream_socket(response.raw)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+    response.close()
+
+
+def _stream_socket(raw):
+    connection = getattr(raw, 'connection', None)
+    if getattr(connection, 'sock', None) is not None:
+        return connection.sock
+    # httplib lets go of the connection's socket when the response has no length,
+    # as the stream's does, so look for it under the response's file
+    fp = getattr(getattr(raw, '_fp', None), 'fp', None)
+    return getattr(getattr(fp, 'raw', fp), '_sock', None)
+
+
+class CameraUnavailable(requests.ConnectionError):
+    ''' Raised instead of making a request while the camera is known to be unreachable '''
 
 
 class Camera(object):
-    def __init__(self, host, port, user, password):
+    def __init__(self, host, port, user, password,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 pool_size=POOL_SIZE, max_requests=requestscheduler.MAX_REQUESTS,
+                 request_rate=requestscheduler.RATE):
+        self.host = host
+        self.port = port
+
         self._cmd_url_fmt = "http://{0}:{1}/cgi-bin/CGIProxy.fcgi?cmd={{0}}&usr={2}&pwd={3}".format(host,
                                                                                                     port,
                                                                                                     user,
@@ -87,6 +159,23 @@ class Camera(object):
 
         self._video_url = "rtsp://{0}:{1}@{2}:{3}/videoMain".format(user, password, host, port)
 
+        self._timeout = (connect_timeout, read_timeout)
+
+        # One keep-alive pool per camera so that repeated CGI calls and the
+        # MJPEG stream reuse connections instead of opening a new one each time.
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('http://', adapter)
+        self._requests = requestscheduler.RequestScheduler(max_requests, request_rate)
+        self._health = circuitbreaker.CircuitBreaker(on_change=self._health_changed)
+
+        self._config_cache = {}
+        self._config_lock = threading.Lock()
+        self._mjpeg_enabled = False
+
+    def close(self):
+        self._session.close()
+
     @property
     def video_url(self):
         return self._video_url
@@ -95,30 +184,98 @@ class Camera(object):
     def mjpeg_url(self):
         return self._stream_url_fmt.format(cmd='GetMJStream')
 
-    def send_command(self, cmd, data=False, **params):
+    def send_command(self, cmd, data=False, priority=None, **params):
+        ''' Sends a CGI command, at the command's own priority unless one is given '''
+        if priority is None:
+            priority = command_priority(cmd)
         url = self._cmd_url_fmt.format(cmd)
         if params:
-            url += "&" + urllib.urlencode(params)
+            url += "&" + urlencode(params)
 
-        utils.log_verbose(url)
+        host.log_verbose(url)
+        # A read can share the response to an identical one which is still queued
+        key = url if cmd.startswith("get") else None
         try:
-            response = requests.get(url)
-        except (requests.RequestException) as e:
-            utils.log_error(str(e))
+            response = self._call(lambda: self._get(cmd, url), priority, key)
+        except CameraUnavailable:
+            metrics.incr("command.{0}.rejected".format(cmd))
+            return False
+        except UNREACHABLE_ERRORS as e:
+            # The error is logged when the camera is found to be unreachable, not for every command
+            metrics.incr("command.{0}.errors".format(cmd))
+            host.log_verbose(str(e))
+            return False
+        except requests.RequestException as e:
+            metrics.incr("command.{0}.errors".format(cmd))
+            host.log_error(str(e))
             return False
         else:
             if not response:
+                metrics.incr("command.{0}.errors".format(cmd))
                 return False
             elif data:
                 return response.content
             else:
-                utils.log_verbose(response)
+                host.log_verbose(response)
                 xml_resp = CameraXMLResponse(response)
-                utils.log_verbose(xml_resp)
+                host.log_verbose(xml_resp)
                 if not xml_resp:
-                    utils.log_error(xml_resp.message)
+                    host.log_error(xml_resp.message)
                 return xml_resp
 
+    def _call(self, func, priority, key=None):
+        ''' Makes a request through the request scheduler unless the camera is known to be unreachable '''
+        if not self._health.allow():
+            raise CameraUnavailable("{0}:{1} is unreachable".format(self.host, self.port))
+        # Health is recorded where the request runs, so that callers sharing the
+        # result of a duplicate request do not count its failure again
+        return self._requests.call(lambda: self._checked(func), priority, key)
+
+    def _checked(self, func):
+        try:
+            response = func()
+        except UNREACHABLE_ERRORS:
+            self._health.failure()
+            raise
+        except Exception:
+            # The camera answered, even if not as expected
+            self._health.success()
+            raise
+        self._health.success()
+        return response
+
+    def _health_changed(self, old, new, retry):
+        metrics.incr("camera.health.{0}".format(new))
+        if new == circuitbreaker.OPEN and old == circuitbreaker.CLOSED:
+            host.log_error("{0}:{1} is unreachable, retrying in {2:.0f} seconds", self.host, self.port, retry)
+        elif new == circuitbreaker.OPEN:
+            host.log_verbose("{0}:{1} is still unreachable, retrying in {2:.0f} seconds", self.host, self.port, retry)
+        elif new == circuitbreaker.CLOSED:
+            host.log_normal("{0}:{1} is reachable again", self.host, self.port)
+
+    @property
+    def available(self):
+        ''' Whether requests would be made now, rather than failing at once because the camera is unreachable '''
+        return self._health.available
+
+    @property
+    def health(self):
+        ''' The state of the camera's circuit breaker: closed, open or half-open '''
+        return self._health.state
+
+    def _get(self, cmd, url):
+        start_time = time.time()
+        response = self._session.get(url, timeout=self._timeout)
+        elapsed = time.time() - start_time
+        metrics.observe("command.{0}".format(cmd), elapsed)
+        host.log_verbose("{0} took {1:.3f} seconds", cmd, elapsed)
+        return response
+
+    @property
+    def request_stats(self):
+        ''' The queue depth, running requests and dropped duplicates of the request scheduler '''
+        return self._requests.stats()
+
     def test(self):
         response = self.send_command("getDevState")
         if response:
@@ -127,21 +284,29 @@ class Camera(object):
             msg = "Error connecting to camera."
         return bool(response), msg
     
-    def move(self, direction):
-        status = self.send_command("ptzMove" + direction.capitalize())
-        if not status:
-            return status
-        time.sleep(0.5)
-        status = self.send_command("ptzStopRun")
-        if not status:
-            return status
-        return True
-
-    def get_mirror_and_flip(self):
-        return self.send_command("getMirrorAndFlipSetting").values()
+    def start_move(self, direction):
+        ''' Starts moving in a direction until stop_move is called. See ptz.PTZController. '''
+        return self.send_command("ptzMove" + direction.capitalize())
+
+    def stop_move(self):
+        return self.send_command("ptzStopRun")
+
+    def get_mirror_and_flip(self, max_age=0, fetch=True):
+        ''' Returns whether the image is mirrored and flipped, or None if that is not known '''
+        config = self.get_config('getMirrorAndFlipSetting', max_age, fetch)
+        if config is None:
+            return None
+        return config['isMirror'], config['isFlip']
 
     def toggle_mirror_flip(self, action, enable):
-        return self.send_command(action.lower() + "Video", {"is" + action.capitalize(): int(enable)})
+        key = "is" + action.capitalize()
+        response = self.send_command(action.lower() + "Video", **{key: int(enable)})
+        if response:
+            config = self.get_config('getMirrorAndFlipSetting', fetch=False)
+            if config is not None:
+                config[key] = int(enable)
+                self.update_config('getMirrorAndFlipSetting', config)
+        return response
 
     def set_ir_on(self):
         return self.send_command('openInfraLed')
@@ -149,11 +314,54 @@ class Camera(object):
     def set_ir_off(self):
         return self.send_command('closeInfraLed')
 
-    def get_motion_detect_config(self):
-        return self.send_command('getMotionDetectConfig')
+    def get_config(self, get_cmd, max_age=CONFIG_MAX_AGE, fetch=True):
+        ''' Returns a copy of the last known values of a config, fetching them from the
+            camera if they are older than max_age seconds. Without fetch the last known
+            values are returned however old they are, or None if there are none. '''
+        with self._config_lock:
+            cached = self._config_cache.get(get_cmd)
+        if cached is not None and (not fetch or time.time() - cached[0] < max_age):
+            return dict(cached[1])
+        if not fetch:
+            return None
 
-    def get_sound_detect_config(self):
-        return self.send_command('getAudioAlarmConfig')
+        response = self.send_command(get_cmd)
+        if not response:
+            return None
+        config = dict(response.items())
+        self.update_config(get_cmd, config)
+        return dict(config)
+
+    def update_config(self, get_cmd, config):
+        with self._config_lock:
+            self._config_cache[get_cmd] = (time.time(), dict(config))
+
+    def export_configs(self):
+        ''' Returns the cached configs as {get_cmd: (time read, values)} '''
+        with self._config_lock:
+            return dict((get_cmd, (timestamp, dict(config)))
+                        for get_cmd, (timestamp, config) in self._config_cache.items())
+
+    def import_configs(self, configs):
+        ''' Adds configs from export_configs to the cache, unless newer values are already cached '''
+        with self._config_lock:
+            for get_cmd, (timestamp, config) in configs.items():
+                cached = self._config_cache.get(get_cmd)
+                if cached is None or cached[0] < timestamp:
+                    self._config_cache[get_cmd] = (timestamp, dict(config))
+
+    def invalidate_config(self, get_cmd=None):
+        with self._config_lock:
+            if get_cmd is None:
+                self._config_cache.clear()
+            else:
+                self._config_cache.pop(get_cmd, None)
+
+    def get_motion_detect_config(self, max_age=0):
+        return self.get_config('getMotionDetectConfig', max_age)
+
+    def get_sound_detect_config(self, max_age=0):
+        return self.get_config('getAudioAlarmConfig', max_age)
     
     def get_device_state(self):
         return self.send_command('getDevState')
@@ -170,18 +378,52 @@ class Camera(object):
     def set_snapshot_config(self):
         return SetConfigCommand(self, 'setSnapConfig')
     
-    def get_snapshot(self):
-        return self.send_command('snapPicture2', data=True)
+    def set_sub_stream_config(self):
+        return SetConfigCommand(self, 'setSubVideoStreamParam')
+
+    def set_preview_stream(self, width, height, fps=0):
+        ''' Sets the sub stream to the smallest resolution and bit rate which cover the preview size.
+            Returns the command, whose restore method sets the previous values back, or None '''
+        cmd = self.set_sub_stream_config()
+        cmd['resolution'], cmd['bitRate'] = sub_stream_profile(width, height)
+        if fps:
+            cmd['frameRate'] = fps
+        if not cmd.send():
+            return None
+        return cmd
 
-    def enable_mjpeg(self):
-        return self.send_command('setSubStreamFormat', format=1)
+    def get_snapshot(self, priority=requestscheduler.POLL):
+        ''' Returns a JPEG snapshot. A preview fetches them at INTERACTIVE priority,
+            which is not held back by the request rate limit '''
+        return self.send_command('snapPicture2', data=True, priority=priority)
+
+    def reset_stream_format(self):
+        ''' Forgets the sub stream format so that it is set again before the next stream '''
+        self._mjpeg_enabled = False
+
+    def enable_mjpeg(self, force=False):
+        ''' Switches the sub stream to MJPEG unless it is already known to be '''
+        if self._mjpeg_enabled and not force:
+            return True
+        response = self.send_command('setSubStreamFormat', format=1)
+        self._mjpeg_enabled = bool(response)
+        return response
 
     def get_mjpeg_stream(self):
         self.enable_mjpeg()
         try:
-            stream = requests.get(self.mjpeg_url, stream=True).raw
-            stream.readline()
-            return stream
+            with metrics.timer("mjpeg.stream_open"):
+                # Only opening the stream waits for a turn, as it stays open while it is read
+                response = self._call(lambda: self._session.get(self.mjpeg_url, stream=True,
+                                                                 timeout=self._timeout),
+                                       requestscheduler.INTERACTIVE)
+                response.raise_for_status()
+        except CameraUnavailable:
+            return None
         except requests.RequestException as e:
-            utils.log_error(str(e))
+            # The camera may have been reset, so check the format again next time
+            self.reset_stream_format()
+            host.log_error(str(e))
             return None
+        boundary = mjpeg.parse_boundary(response.headers.get('content-type'))
+        return mjpeg.MJPEGParser(response.raw, boundary, close=lambda: close_stream(response))
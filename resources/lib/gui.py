@@ -48,22 +48,28 @@ class ToggleButton(xbmcgui.ControlRadioButton):
 
 
 class CameraPreview(xbmcgui.WindowDialog):
-    def __init__(self, duration, path, scaling, position, mjpeg_stream):
+    WIDTH = 320
+    HEIGHT = 180
+
+    def __init__(self, duration, path, scaling, position, frame_source, camera_index=1, target_fps=0):
         utils.log_normal("Showing preview")
         
         self.buttons = []
         
+        self.camera_index = camera_index
         self.duration = duration
         self.path = path
-        self.mjpeg_stream = mjpeg_stream
+        self.frame_source = frame_source
+        self.target_fps = target_fps
+        self.extract_mjpeg = None
+        self.first_frame_time = None
+        self.key_frame = None
+        self.stopped = False
         
         self.setProperty('zorder', "99")
         
-        WIDTH = 320
-        HEIGHT = 180
-
-        width = int(WIDTH * scaling)
-        height = int(HEIGHT * scaling)
+        width = int(self.WIDTH * scaling)
+        height = int(self.HEIGHT * scaling)
 
         if "bottom" in position:
             y = 720 - height
@@ -98,11 +104,22 @@ class CameraPreview(xbmcgui.WindowDialog):
         self.close_button.setAnimations(animations)
 
     def start(self):
-        with utils.ExtractMJPEGFrames(self.path, self.duration, self.mjpeg_stream,
-                                      self.image.setImage, False) as self.extract_mjpeg:
+        if self.stopped:
+            # Closed while the stream was being opened
+            self.frame_source.close()
+            return 0
+        with utils.ExtractMJPEGFrames(self.path, self.duration, self.frame_source, self.show_frame,
+                                      self.target_fps) as self.extract_mjpeg:
+            if self.stopped:
+                self.extract_mjpeg.stop()
             duration = self.extract_mjpeg.start()
+        self.first_frame_time = self.extract_mjpeg.first_frame_time
+        self.key_frame = self.extract_mjpeg.key_frame
         return duration
 
+    def show_frame(self, filename):
+        self.image.setImage(filename, False)
+
     def onControl(self, control):
         if control == self.close_button:
             self.stop()
@@ -116,12 +133,14 @@ class CameraPreview(xbmcgui.WindowDialog):
             self.run()
             
     def run(self):
-        xbmc.executebuiltin("RunAddon({0})".format(utils.addon_info('id')))
+        xbmc.executebuiltin("RunScript({0}, {1})".format(utils.addon_info('id'), self.camera_index))
         self.stop()
             
     def stop(self):
         utils.log_normal("Closing preview")
+        self.stopped = True
         self.removeControl(self.close_button)
-        self.extract_mjpeg.stop()
+        if self.extract_mjpeg is not None:
+            self.extract_mjpeg.stop()
         self.close()
 
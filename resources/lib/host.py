@@ -0,0 +1,49 @@
+''' The services the camera core needs from the program it runs in.
+
+    foscam, cgixml and mjpeg only log and read settings through this module, so they
+    can be imported without Kodi. Until a host is set, messages are dropped and
+    settings have their defaults. utils sets a host backed by Kodi when it is imported. '''
+
+
+class Host(object):
+    ''' A host which drops log messages and has no settings '''
+
+    def log_normal(self, message, *args):
+        pass
+
+    def log_verbose(self, message, *args):
+        pass
+
+    def log_error(self, message, *args):
+        pass
+
+    def get_setting(self, ident, default=None):
+        return default
+
+
+_host = Host()
+
+
+def set_host(host):
+    global _host
+    _host = host
+
+
+def get_host():
+    return _host
+
+
+def log_normal(message, *args):
+    _host.log_normal(message, *args)
+
+
+def log_verbose(message, *args):
+    _host.log_verbose(message, *args)
+
+
+def log_error(message, *args):
+    _host.log_error(message, *args)
+
+
+def get_setting(ident, default=None):
+    return _host.get_setting(ident, default)
@@ -0,0 +1,133 @@
+import json
+import time
+import bisect
+import threading
+
+import fileutils
+
+
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 30, 60)
+
+DUMP_INTERVAL = 60
+
+
+class Histogram(object):
+    ''' Counts observed values in fixed buckets along with their total, minimum and maximum '''
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        ''' Returns the upper bound of the bucket containing the given percentile '''
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            if total >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count,
+                'sum': self.sum,
+                'min': self.min,
+                'max': self.max,
+                'mean': self.sum / self.count if self.count else None,
+                'p50': self.percentile(50),
+                'p90': self.percentile(90),
+                'p99': self.percentile(99),
+                'buckets': [[bound, count] for bound, count
+                            in zip(self.buckets + (None,), self.counts)]}
+
+
+class _Timer(object):
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.elapsed = time.time() - self.start
+        self.registry.observe(self.name, self.elapsed)
+
+
+class Registry(object):
+    ''' Thread safe counters and latency histograms identified by name '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._counters = {}
+        self._histograms = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def timer(self, name):
+        ''' Returns a context manager which observes the time taken by its block '''
+        return _Timer(self, name)
+
+    def snapshot(self):
+        with self._lock:
+            return {'started': self._started,
+                    'time': time.time(),
+                    'counters': dict(self._counters),
+                    'histograms': dict((name, histogram.to_dict())
+                                       for name, histogram in self._histograms.items())}
+
+    def dump(self, filename):
+        tmp = filename + ".tmp"
+        with open(tmp, 'w') as output:
+            json.dump(self.snapshot(), output, indent=2, sort_keys=True)
+        fileutils.replace_file(tmp, filename)
+
+
+registry = Registry()
+
+
+class PeriodicDump(threading.Thread):
+    ''' Writes the registry to a JSON file at a fixed interval until stopped '''
+
+    def __init__(self, filename, interval=DUMP_INTERVAL, registry=registry):
+        threading.Thread.__init__(self, name="metrics")
+        self.daemon = True
+
+        self.filename = filename
+        self.interval = interval
+        self.registry = registry
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.registry.dump(self.filename)
+        self.registry.dump(self.filename)
@@ -0,0 +1,284 @@
+import re
+import time
+import threading
+
+from metrics import registry as metrics
+
+
+JPEG_SOI = b'\xff\xd8'
+JPEG_EOI = b'\xff\xd9'
+
+HEADER_END = b'\r\n\r\n'
+
+CHUNK_SIZE = 64 * 1024
+HEADER_CHUNK_SIZE = 512
+MAX_HEADER_SIZE = 4096
+
+_BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+_CONTENT_LENGTH_RE = re.compile(br'^content-length:\s*(\d+)\s*$', re.IGNORECASE | re.MULTILINE)
+
+
+def parse_boundary(content_type):
+    ''' Returns the multipart boundary from a Content-Type header value, or None '''
+    match = _BOUNDARY_RE.search(content_type or '')
+    if match is None:
+        return None
+    return match.group(1).strip().lstrip('-')
+
+
+class MJPEGParser(object):
+    ''' Reads JPEG frames from a multipart MJPEG stream.
+
+        Each part is found by its boundary and sized by its Content-Length header
+        (or by the next boundary if there is none). Data is read into a buffer which
+        is reused for every frame, and parts which are not complete JPEG images are
+        skipped so that a corrupt frame does not desynchronise the stream.
+
+        Frames which are not wanted can be discarded as soon as their headers arrive,
+        without reading their bodies into the frame buffer. close, if given, is called
+        instead of closing the stream, for streams which need more to stop a read
+        in another thread. '''
+
+    def __init__(self, stream, boundary=None, chunk_size=CHUNK_SIZE, close=None):
+        self.stream = stream
+        self._close = close or stream.close
+        self._marker = b'--' + boundary.encode('ascii') if boundary else b'--'
+
+        self._buffer = bytearray(4 * chunk_size)
+        self._chunk_size = chunk_size
+        self._start = 0
+        self._end = 0
+        self._eof = False
+
+        self._readinto = getattr(stream, 'readinto', None)
+        self._scratch = None
+
+        self.frames = 0
+        self.skipped_frames = 0
+        self.corrupt_frames = 0
+        self.bytes_read = 0
+
+    def close(self):
+        self._close()
+
+    def __iter__(self):
+        while True:
+            frame = self.next_frame()
+            if frame is None:
+                break
+            yield frame
+
+    def next_frame(self, wanted=None):
+        ''' Returns a memoryview of the next JPEG frame, or None at the end of the stream.
+
+            If given, wanted is called when the headers of each part have arrived and
+            the part is discarded if it returns False.
+            The view is only valid until the next call. '''
+        while True:
+            part = self._next_part(wanted)
+            if part is None:
+                return None
+
+            body_start, length = part
+            body_end = body_start + length
+            # Allow for padding after the end of image marker
+            if (self._buffer.startswith(JPEG_SOI, body_start)
+                and self._buffer.find(JPEG_EOI, body_end - 4, body_end) >= 0):
+                self._start = body_end
+                self.frames += 1
+                return memoryview(self._buffer)[body_start:body_end]
+
+            # Resynchronise on the next boundary after the start of this part's body
+            self.corrupt_frames += 1
+            self._start = body_start
+
+    def _next_part(self, wanted=None):
+        ''' Finds the next wanted part and makes sure its whole body is in the buffer.
+            Returns the position and length of the body. '''
+        while True:
+            pos = self._buffer.find(self._marker, self._start, self._end)
+            if pos < 0:
+                # Keep enough bytes to match a boundary split between reads
+                self._start = max(self._start, self._end - len(self._marker))
+                if not self._fill(HEADER_CHUNK_SIZE):
+                    return None
+                continue
+            self._start = pos
+
+            header_end = self._buffer.find(HEADER_END, pos, self._end)
+            if header_end < 0:
+                if self._end - pos > MAX_HEADER_SIZE:
+                    self.corrupt_frames += 1
+                    self._start = pos + len(self._marker)
+                elif not self._fill(HEADER_CHUNK_SIZE):
+                    return None
+                continue
+
+            headers = bytes(self._buffer[pos:header_end])
+            if self._marker == b'--':
+                self._marker = headers.split(b'\r\n', 1)[0].rstrip()
+
+            body_start = header_end + len(HEADER_END)
+            match = _CONTENT_LENGTH_RE.search(headers)
+            if match is not None:
+                length = int(match.group(1))
+                if wanted is not None and not wanted():
+                    if not self._discard(body_start, length):
+                        return None
+                    self.skipped_frames += 1
+                    continue
+                while self._end - body_start < length:
+                    if not self._fill(length - (self._end - body_start)):
+                        return None
+                    body_start = self._start + (body_start - pos)
+                    pos = self._start
+                return body_start, length
+
+            next_pos = self._buffer.find(self._marker, body_start, self._end)
+            while next_pos < 0:
+                search_from = max(body_start, self._end - len(self._marker))
+                if not self._fill(self._chunk_size):
+                    return None
+                body_start = self._start + (body_start - pos)
+                search_from = self._start + (search_from - pos)
+                pos = self._start
+                next_pos = self._buffer.find(self._marker, search_from, self._end)
+            length = len(self._buffer[body_start:next_pos].rstrip(b'\r\n'))
+            if wanted is not None and not wanted():
+                self._start = next_pos
+                self.skipped_frames += 1
+                continue
+            return body_start, length
+
+    def _discard(self, body_start, length):
+        ''' Skips a part body by reading whatever has not yet arrived into a scratch buffer '''
+        buffered = min(length, self._end - body_start)
+        self._start = body_start + buffered
+        remaining = length - buffered
+        if not remaining:
+            return True
+
+        if self._scratch is None:
+            self._scratch = bytearray(self._chunk_size)
+        while remaining:
+            size = min(remaining, len(self._scratch))
+            if self._readinto is not None:
+                count = self._readinto(memoryview(self._scratch)[:size])
+            else:
+                count = len(self.stream.read(size))
+            if not count:
+                self._eof = True
+                return False
+            remaining -= count
+            self.bytes_read += count
+        return True
+
+    def _fill(self, size):
+        ''' Reads up to size more bytes into the buffer, moving the unread data to the
+            front of the buffer first if needed. Returns False at the end of the stream. '''
+        if self._eof:
+            return False
+
+        size = max(size, 1)
+        if self._end + size > len(self._buffer):
+            remaining = self._end - self._start
+            if remaining + size > len(self._buffer):
+                # Frame views handed out earlier may still exist, so the buffer
+                # is replaced rather than resized
+                buffer = bytearray(max(2 * len(self._buffer), remaining + size))
+            else:
+                buffer = self._buffer
+            buffer[:remaining] = self._buffer[self._start:self._end]
+            self._buffer = buffer
+            self._start = 0
+            self._end = remaining
+
+        if self._readinto is not None:
+            count = self._readinto(memoryview(self._buffer)[self._end:self._end + size])
+        else:
+            data = self.stream.read(size)
+            count = len(data)
+            self._buffer[self._end:self._end + count] = data
+
+        if not count:
+            self._eof = True
+            return False
+
+        self._end += count
+        self.bytes_read += count
+        return True
+
+
+class FrameReader(threading.Thread):
+    ''' Reads frames from a parser on a background thread and keeps only the newest one.
+
+        The parser can be an MJPEGParser or anything with its interface. A frame which
+        has not been taken by the time the next one arrives is replaced, so a slow
+        consumer never backs up the stream and a stalled stream never blocks the
+        consumer for longer than it chooses to wait. wanted is passed on to the parser. '''
+
+    def __init__(self, parser, wanted=None):
+        threading.Thread.__init__(self, name="mjpeg-reader")
+        self.daemon = True
+
+        self.parser = parser
+        self.wanted = wanted
+
+        self.replaced = 0
+        self.ended = False
+        self.error = None
+
+        self._condition = threading.Condition()
+        self._frame = None
+        self._frame_time = None
+        self._stopped = False
+
+    def stop(self):
+        ''' Ends the thread and wakes anything waiting in get(). The parser is closed
+            so that a read which is waiting for data fails rather than times out. '''
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        try:
+            self.parser.close()
+        except Exception:
+            pass
+
+    def get(self, timeout=None):
+        ''' Waits up to timeout seconds for a frame which has not been taken yet.
+            Returns the frame and the time it was read, or None and None. '''
+        with self._condition:
+            end_time = time.time() + timeout if timeout is not None else None
+            while self._frame is None and not (self.ended or self._stopped):
+                remaining = end_time - time.time() if end_time is not None else None
+                if remaining is not None and remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            frame, frame_time = self._frame, self._frame_time
+            self._frame = None
+            return frame, frame_time
+
+    def run(self):
+        try:
+            while not self._stopped:
+                with metrics.timer("mjpeg.frame_read"):
+                    frame = self.parser.next_frame(self.wanted)
+                if frame is None:
+                    break
+                # The parser reuses its buffer for the next frame. bytes() of a
+                # memoryview is its repr rather than its contents on Python 2.
+                if isinstance(frame, memoryview):
+                    frame = frame.tobytes()
+                with self._condition:
+                    if self._frame is not None:
+                        self.replaced += 1
+                    self._frame = frame
+                    self._frame_time = time.time()
+                    self._condition.notify_all()
+        except Exception as e:
+            if not self._stopped:
+                self.error = e
+        finally:
+            with self._condition:
+                self.ended = True
+                self._condition.notify_all()
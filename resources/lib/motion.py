@@ -0,0 +1,124 @@
+''' Scores motion between camera frames, to check alarms before showing a preview.
+
+    NumPy and PIL are optional. They are only imported when motion is first scored,
+    and available() is False if either is missing. '''
+
+import io
+
+from metrics import registry as metrics
+
+
+# Frames are scaled down while they are decoded, to no smaller than this
+DECODE_SIZE = (160, 90)
+# How much a pixel must change, out of 255, after removing any change in overall brightness
+PIXEL_THRESHOLD = 25
+
+_modules = None
+
+
+def _load():
+    global _modules
+    if _modules is None:
+        try:
+            import numpy
+            from PIL import Image
+        except ImportError:
+            _modules = ()
+        else:
+            _modules = (numpy, Image)
+    return _modules
+
+
+def available():
+    return bool(_load())
+
+
+def parse_areas(text):
+    ''' Parses areas given as left,top,right,bottom percentages of the frame, separated by semicolons.
+        Returns a list of (left, top, right, bottom) fractions. Raises ValueError if the text is invalid. '''
+    areas = []
+    for area in text.split(';'):
+        if not area.strip():
+            continue
+        bounds = [float(value) / 100 for value in area.split(',')]
+        if len(bounds) != 4:
+            raise ValueError("An area needs four values: {0}".format(area))
+        left, top, right, bottom = bounds
+        if not (0 <= left < right <= 1 and 0 <= top < bottom <= 1):
+            raise ValueError("Area outside the frame: {0}".format(area))
+        areas.append((left, top, right, bottom))
+    return areas
+
+
+def decode(data, size=DECODE_SIZE):
+    ''' Decodes a JPEG image to an array of grey levels, scaled down by as much as the
+        decoder can while keeping it at least size '''
+    numpy, Image = _load()
+    image = Image.open(io.BytesIO(data))
+    # The JPEG decoder can scale by a half, a quarter or an eighth while decoding,
+    # which is far cheaper than decoding in full, and resizing would cost more than it saves
+    image.draft('L', size)
+    return numpy.asarray(image.convert('L'), dtype=numpy.int16)
+
+
+class MotionScorer(object):
+    ''' Scores motion as the largest fraction of the checked areas which changed between
+        consecutive frames. The whole frame is checked if no areas are given.
+
+        The mean brightness of the checked areas is removed from each frame before
+        they are compared, so that light being switched on or the camera changing to
+        night mode is not scored as motion. '''
+
+    def __init__(self, areas=(), size=DECODE_SIZE, pixel_threshold=PIXEL_THRESHOLD):
+        self.areas = list(areas)
+        self.size = size
+        self.pixel_threshold = pixel_threshold
+        self._masks = {}
+
+    def _mask(self, shape):
+        ''' Returns the mask for a frame shape, or None for the whole frame '''
+        if not self.areas:
+            return None
+        mask = self._masks.get(shape)
+        if mask is None:
+            numpy = _load()[0]
+            height, width = shape
+            mask = numpy.zeros(shape, dtype=bool)
+            for left, top, right, bottom in self.areas:
+                # An area smaller than a pixel of the scaled down frame still checks one pixel
+                top, left = int(top * height), int(left * width)
+                mask[top:max(top + 1, int(round(bottom * height))),
+                     left:max(left + 1, int(round(right * width)))] = True
+            self._masks[shape] = mask
+        return mask
+
+    def pixels(self, data):
+        ''' Returns the checked pixels of a frame with their mean removed '''
+        with metrics.timer("motion.decode"):
+            frame = decode(data, self.size)
+        mask = self._mask(frame.shape)
+        pixels = frame[mask] if mask is not None else frame.ravel()
+        return pixels - int(pixels.mean())
+
+    def score(self, frames):
+        ''' Returns the score of a sequence of JPEG frames, skipping any which cannot be decoded,
+            or None if fewer than two frames could be compared '''
+        numpy = _load()[0]
+        best = None
+        previous = None
+        for data in frames:
+            if not data:
+                continue
+            try:
+                pixels = self.pixels(data)
+            except (IOError, ValueError):
+                metrics.incr("motion.corrupt_frames")
+                continue
+
+            if previous is not None and previous.shape == pixels.shape:
+                with metrics.timer("motion.score"):
+                    changed = numpy.count_nonzero(numpy.abs(pixels - previous) > self.pixel_threshold)
+                score = changed / float(pixels.size)
+                best = score if best is None else max(best, score)
+            previous = pixels
+        return best
@@ -0,0 +1,80 @@
+import time
+import threading
+
+import host
+
+
+HOLD_TIME = 0.5
+
+
+class PTZController(threading.Thread):
+    ''' Moves a camera from a background thread so that callers never wait for it.
+
+        move() returns at once. The first request for a direction starts the camera
+        moving, and it is stopped once no request has arrived for hold_time seconds,
+        so held or repeated presses become one continuous move with a single stop.
+        A request for another direction cancels the pending stop and turns the camera
+        without stopping it first. Requests which arrive while a command is being sent
+        are coalesced, so only the latest one is acted on.
+
+        on_error is called from the controller's thread with the failed response. '''
+
+    def __init__(self, camera, hold_time=HOLD_TIME, on_error=None):
+        threading.Thread.__init__(self, name="ptz")
+        self.daemon = True
+
+        self.camera = camera
+        self.hold_time = hold_time
+        self.on_error = on_error or (lambda response: None)
+
+        self._condition = threading.Condition()
+        self._direction = None
+        self._until = 0
+        self._closed = False
+
+    def move(self, direction):
+        with self._condition:
+            self._direction = direction
+            self._until = time.time() + self.hold_time
+            self._condition.notify()
+
+    def halt(self):
+        ''' Stops the camera now rather than when the hold time runs out '''
+        with self._condition:
+            self._until = 0
+            self._condition.notify()
+
+    def close(self):
+        ''' Stops the camera if it is moving and ends the thread '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def _wanted(self, moving):
+        ''' Waits until the camera should change what it is doing and returns the new direction '''
+        with self._condition:
+            while True:
+                if self._closed:
+                    return None
+                now = time.time()
+                wanted = self._direction if now < self._until else None
+                if wanted != moving:
+                    return wanted
+                self._condition.wait(self._until - now if moving else None)
+
+    def run(self):
+        moving = None
+        while True:
+            wanted = self._wanted(moving)
+            if wanted is None and moving is None:
+                break
+
+            if wanted is None:
+                host.log_verbose("Stopping PTZ move")
+                response = self.camera.stop_move()
+            else:
+                host.log_verbose("PTZ move {0}", wanted)
+                response = self.camera.start_move(wanted)
+            if not response:
+                self.on_error(response)
+            moving = wanted
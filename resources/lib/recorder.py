@@ -0,0 +1,176 @@
+import os
+import time
+import threading
+from collections import deque
+
+from metrics import registry as metrics
+
+
+BOUNDARY = "foscamframe"
+PART_HEADER = "--{0}\r\nContent-Type: image/jpeg\r\nContent-Length: {1}\r\nX-Timestamp: {2:.3f}\r\n\r\n"
+PART_END = b"\r\n"
+FILE_EXTENSION = ".mjpeg"
+
+CAPTURE_INTERVAL = 1.0
+BATCH_SIZE = 256 * 1024
+MAX_FILES = 10
+
+
+class FrameBuffer(object):
+    ''' The most recent frames and their times, limited by their total size in bytes '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._frames = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def append(self, data, timestamp):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._frames.append((timestamp, data))
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                self.size -= len(self._frames.popleft()[1])
+
+    def since(self, timestamp):
+        with self._lock:
+            return [frame for frame in self._frames if frame[0] >= timestamp]
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.size = 0
+
+
+class MJPEGSpool(object):
+    ''' Writes frames to multipart MJPEG files in the format the cameras stream.
+
+        Frames are collected and written in batches. A file which would grow beyond
+        max_bytes is closed and a new one started, and only the newest max_files
+        files with the same prefix are kept. '''
+
+    def __init__(self, path, prefix, max_bytes, max_files=MAX_FILES, batch_size=BATCH_SIZE):
+        self.path = path
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.batch_size = batch_size
+
+        self.filename = None
+        self._file = None
+        self._file_size = 0
+        self._batch = []
+        self._batch_size = 0
+
+    def write(self, data, timestamp):
+        header = PART_HEADER.format(BOUNDARY, len(data), timestamp).encode('ascii')
+        size = len(header) + len(data) + len(PART_END)
+        if self._file is None or (self._file_size and self._file_size + size > self.max_bytes):
+            self._rotate(timestamp)
+
+        self._batch.extend((header, data, PART_END))
+        self._batch_size += size
+        self._file_size += size
+        metrics.incr("recorder.frames")
+        if self._batch_size >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+        with metrics.timer("recorder.flush"):
+            self._file.write(b"".join(self._batch))
+            self._file.flush()
+        metrics.incr("recorder.bytes", self._batch_size)
+        self._batch = []
+        self._batch_size = 0
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def _rotate(self, timestamp):
+        self.close()
+        name = "{0}-{1}-{2:03d}{3}".format(self.prefix,
+                                           time.strftime("%Y%m%d-%H%M%S", time.localtime(timestamp)),
+                                           int(timestamp * 1000) % 1000, FILE_EXTENSION)
+        self.filename = os.path.join(self.path, name)
+        self._file = open(self.filename, 'wb')
+        self._file_size = 0
+        self._prune()
+
+    def _prune(self):
+        names = sorted(name for name in os.listdir(self.path)
+                       if name.startswith(self.prefix + "-") and name.endswith(FILE_EXTENSION))
+        for name in names[:-self.max_files]:
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+
+
+class PreAlarmRecorder(threading.Thread):
+    ''' Captures frames at a low rate into a FrameBuffer, and spools them to disk while recording.
+
+        record() writes the buffered frames from the last pre_alarm seconds and then the
+        live frames until its duration has passed. All file writes are made by the
+        recorder's own thread, so record() returns at once. '''
+
+    def __init__(self, get_data, spool, max_bytes, pre_alarm, interval=CAPTURE_INTERVAL,
+                 log=None, name="recorder"):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+
+        self.get_data = get_data
+        self.spool = spool
+        self.buffer = FrameBuffer(max_bytes)
+        self.pre_alarm = pre_alarm
+        self.interval = interval
+        self.log = log or (lambda message, *args: None)
+
+        self._lock = threading.Lock()
+        self._record_from = None
+        self._record_until = 0
+        self._stop_event = threading.Event()
+
+    def record(self, duration, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            if now >= self._record_until:
+                self._record_from = now - self.pre_alarm
+            self._record_until = max(self._record_until, now + duration)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        next_capture = time.time()
+        while not self._stop_event.wait(max(0, next_capture - time.time())):
+            next_capture = time.time() + self.interval
+            data = self.get_data()
+            if data:
+                self._capture(data, time.time())
+        self.spool.close()
+
+    def _capture(self, data, now):
+        self.buffer.append(data, now)
+        with self._lock:
+            record_from, self._record_from = self._record_from, None
+            recording = now < self._record_until
+
+        if record_from is not None:
+            frames = self.buffer.since(record_from)
+            self.log("Recording {0} buffered frames to {1}", len(frames), self.spool.path)
+            for timestamp, frame in frames:
+                self.spool.write(frame, timestamp)
+        elif recording:
+            self.spool.write(data, now)
+        else:
+            self.spool.close()
@@ -0,0 +1,135 @@
+import time
+import heapq
+import itertools
+import threading
+
+from metrics import registry as metrics
+
+
+INTERACTIVE = 0
+POLL = 1
+CONFIG = 2
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", POLL: "poll", CONFIG: "config"}
+
+MAX_REQUESTS = 2
+RATE = 10.0
+BURST = 5
+
+
+class _Request(object):
+    __slots__ = ('priority', 'key', 'queued', 'done', 'result', 'exception')
+
+    def __init__(self, priority, key, queued):
+        self.priority = priority
+        self.key = key
+        self.queued = queued
+        self.done = False
+        self.result = None
+        self.exception = None
+
+
+class RequestScheduler(object):
+    ''' Orders and limits the requests made to one camera, whose firmware only
+        handles a few connections at once.
+
+        call() runs a request on the calling thread once it is at the front of the
+        queue, fewer than max_requests are running and the token bucket, which refills
+        at rate tokens a second up to burst, has a token. INTERACTIVE requests do not
+        need a token, as the user or a preview sets their pace. Requests are queued by
+        priority and then in order of arrival. A request with the same key as one
+        which is still queued is not queued again, but waits for and returns the
+        result of the queued one. '''
+
+    def __init__(self, max_requests=MAX_REQUESTS, rate=RATE, burst=BURST):
+        self.max_requests = max_requests
+        self.rate = rate
+        self.burst = burst
+
+        self.active = 0
+        self.max_depth = 0
+        self.dropped = 0
+
+        self._condition = threading.Condition()
+        self._queue = []
+        self._queued_keys = {}
+        self._sequence = itertools.count()
+        self._tokens = float(burst)
+        self._refilled = time.time()
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        with self._condition:
+            return {'depth': len(self._queue),
+                    'active': self.active,
+                    'max_depth': self.max_depth,
+                    'dropped': self.dropped}
+
+    def call(self, func, priority=POLL, key=None):
+        with self._condition:
+            queued = self._queued_keys.get(key) if key is not None else None
+            if queued is not None:
+                self.dropped += 1
+                metrics.incr("camera.requests.dropped")
+                while not queued.done:
+                    self._condition.wait()
+                if queued.exception is not None:
+                    raise queued.exception
+                return queued.result
+
+            request = self._enqueue(priority, key)
+            self._wait_turn(request)
+
+        try:
+            request.result = func()
+            return request.result
+        except Exception as e:
+            request.exception = e
+            raise
+        finally:
+            with self._condition:
+                self.active -= 1
+                request.done = True
+                self._condition.notify_all()
+
+    def _enqueue(self, priority, key):
+        request = _Request(priority, key, time.time())
+        heapq.heappush(self._queue, (priority, next(self._sequence), request))
+        if key is not None:
+            self._queued_keys[key] = request
+        self.max_depth = max(self.max_depth, len(self._queue))
+        metrics.observe("camera.queue_depth", len(self._queue))
+        return request
+
+    def _wait_turn(self, request):
+        while True:
+            timeout = None
+            if self._queue[0][2] is request and self.active < self.max_requests:
+                if request.priority == INTERACTIVE:
+                    break
+                timeout = self._take_token()
+                if timeout is None:
+                    break
+            self._condition.wait(timeout)
+
+        heapq.heappop(self._queue)
+        if request.key is not None:
+            del self._queued_keys[request.key]
+        self.active += 1
+        # The next request may be able to start as well
+        self._condition.notify_all()
+        metrics.observe("camera.queue_wait.{0}".format(PRIORITY_NAMES.get(request.priority, request.priority)),
+                        time.time() - request.queued)
+
+    def _take_token(self):
+        ''' Takes a token and returns None, or returns how long until there is one '''
+        now = time.time()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return None
+        return (1 - self._tokens) / self.rate
@@ -0,0 +1,162 @@
+import time
+import random
+import threading
+from collections import deque, namedtuple
+
+from metrics import registry as metrics
+
+
+FAST_WINDOW = 120
+FAST_FACTOR = 0.5
+IDLE_AFTER = 600
+IDLE_FACTOR = 1.5
+MAX_IDLE_FACTOR = 2
+MAX_BACKOFF = 300
+MAX_WAIT = 10
+JITTER = 0.1
+MIN_INTERVAL = 1
+
+HISTORY = 200
+
+
+Decision = namedtuple('Decision', 'time key delay reason')
+
+
+class _Entry(object):
+    __slots__ = ('deadline', 'busy', 'failures', 'idle_factor', 'last_alarm', 'hold_off_until')
+
+    def __init__(self, now):
+        self.deadline = now
+        self.busy = False
+        self.failures = 0
+        self.idle_factor = 1.0
+        self.last_alarm = now
+        self.hold_off_until = None
+
+
+class PollScheduler(object):
+    ''' Decides when each camera is next polled for alarms.
+
+        Cameras are polled at the base interval, faster for a while after an alarm,
+        and progressively slower while they are idle. Unreachable cameras back off
+        exponentially, and no polls are made while an alarm is being held off.
+        Random jitter keeps cameras from being polled in lock step.
+        Every decision is kept in a bounded history.
+
+        Waits are capped at MAX_WAIT seconds so that cameras added while the caller
+        is waiting are picked up reasonably soon. '''
+
+    def __init__(self, interval, log=None, random=random.random):
+        self.interval = interval
+        self.log = log or (lambda message, *args: None)
+        self.decisions = deque(maxlen=HISTORY)
+
+        self._random = random
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def set_interval(self, interval):
+        with self._lock:
+            self.interval = interval
+
+    def add(self, key, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            self._entries[key] = _Entry(now)
+        self._decide(now, key, 0, "added")
+
+    def remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def wait_time(self, now=None):
+        ''' Returns the number of seconds until the next poll is due '''
+        now = time.time() if now is None else now
+        with self._lock:
+            if not self._entries:
+                return MAX_WAIT
+            deadline = min(entry.deadline for entry in self._entries.values())
+        return min(MAX_WAIT, max(0, deadline - now))
+
+    def due(self, now=None):
+        ''' Returns the cameras which are due to be polled now and marks them as busy.
+
+            Each one is given a provisional deadline so that the caller can wait without
+            knowing when the poll will finish. The outcome can only postpone it. '''
+        now = time.time() if now is None else now
+        due = []
+        decisions = []
+        with self._lock:
+            for key, entry in self._entries.items():
+                if entry.deadline > now:
+                    continue
+                if entry.busy:
+                    delay = self._jittered(self.interval)
+                    entry.deadline = now + delay
+                    decisions.append((key, delay, "still busy"))
+                    continue
+
+                metrics.observe("poll.jitter", now - entry.deadline)
+                delay, reason = self._next_interval(entry, now)
+                entry.busy = True
+                entry.deadline = now + delay
+                decisions.append((key, delay, reason))
+                due.append(key)
+
+        for key, delay, reason in decisions:
+            self._decide(now, key, delay, reason)
+        return due
+
+    def completed(self, key, reachable=True, now=None):
+        ''' Records the outcome of a poll, postponing the next one if the camera is unreachable '''
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.busy = False
+            if reachable:
+                entry.failures = 0
+                return
+            entry.failures += 1
+            delay = self._jittered(min(MAX_BACKOFF, self.interval * 2 ** entry.failures))
+            entry.deadline = max(entry.deadline, now + delay)
+            delay = entry.deadline - now
+            failures = entry.failures
+
+        self._decide(now, key, delay, "unreachable ({0} failures)".format(failures))
+
+    def alarm(self, key, hold_off, now=None):
+        ''' Records an alarm and postpones polling until the camera can trigger again '''
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.last_alarm = now
+            entry.idle_factor = 1.0
+            entry.hold_off_until = now + hold_off
+            entry.deadline = max(entry.deadline, entry.hold_off_until)
+
+        self._decide(now, key, hold_off, "alarm hold-off")
+
+    def _next_interval(self, entry, now):
+        if entry.failures:
+            return self._jittered(min(MAX_BACKOFF, self.interval * 2 ** entry.failures)), "backing off"
+
+        if entry.hold_off_until is not None and now - entry.hold_off_until < FAST_WINDOW:
+            return max(MIN_INTERVAL, self._jittered(self.interval * FAST_FACTOR)), "after alarm"
+
+        if now - entry.last_alarm > IDLE_AFTER:
+            entry.idle_factor = min(MAX_IDLE_FACTOR, entry.idle_factor * IDLE_FACTOR)
+            return self._jittered(self.interval * entry.idle_factor), "idle"
+
+        return self._jittered(self.interval), "normal"
+
+    def _jittered(self, interval):
+        return max(MIN_INTERVAL, interval * (1 + JITTER * (2 * self._random() - 1)))
+
+    def _decide(self, now, key, delay, reason):
+        self.decisions.append(Decision(now, key, delay, reason))
+        metrics.incr("poll.decisions.{0}".format(reason.split(' (')[0].replace(' ', '_')))
+        self.log("Next poll of {0} in {1:.1f} seconds: {2}", key, delay, reason)
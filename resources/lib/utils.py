@@ -1,12 +1,18 @@
 import os
 import time
-import glob
+import threading
+import collections
+import xml.etree.ElementTree as ET
 
 import xbmc
 import xbmcaddon
 import xbmcgui
 
-import requests
+import host
+import mjpeg
+import fileutils
+import workers
+from metrics import registry as metrics
 
 
 __addon__ = xbmcaddon.Addon()
@@ -18,6 +24,7 @@ __version__ = __addon__.getAddonInfo('version')
 addon_name = __addon__.getLocalizedString(32000)
 
 TEXTURE_FMT = os.path.join(__addon__.getAddonInfo('path'), 'resources', 'media', '{0}.png')
+SETTINGS_XML = os.path.join(__addon__.getAddonInfo('path'), 'resources', 'settings.xml')
 
 ACTION_PREVIOUS_MENU = 10
 ACTION_BACKSPACE = 110
@@ -28,20 +35,146 @@ ACTION_SELECT_ITEM = 7
 INVALID_PASSWORD_CHARS = ('{', '}', ':', ';', '!', '?', '@', '\\', '/')
 INVALID_USER_CHARS = ('@',)
 
+FRAME_SLOTS = 3
+SNAPSHOT_DEPTH = 2
+MAX_SNAPSHOT_FAILURES = 3
+LATENCY_WEIGHT = 0.25
+MEMORY_PATH = '/dev/shm'
+
+MAX_CAMERAS = 3
+
+LOG_NORMAL = 1
+LOG_VERBOSE = 2
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def _to_bool(value):
+    return value == "true"
+
+def _setting_types():
+    ''' Returns the conversion for each setting declared in settings.xml '''
+    types = {}
+    for setting in ET.parse(SETTINGS_XML).iter('setting'):
+        ident = setting.get('id')
+        if ident is None:
+            continue
+        kind = setting.get('type')
+        if kind == 'bool':
+            types[ident] = _to_bool
+        elif kind in ('number', 'enum') or (kind == 'slider' and setting.get('option') == 'int'):
+            types[ident] = _to_int
+        elif kind == 'slider':
+            types[ident] = _to_float
+        else:
+            types[ident] = str
+    return types
+
+
+class Settings(object):
+    ''' An immutable snapshot of the addon settings with values converted to their types '''
+
+    def __init__(self, types, raw):
+        self._types = types
+        self._raw = raw
+        self._values = dict((ident, types.get(ident, str)(value))
+                            for ident, value in raw.iteritems())
+
+    @classmethod
+    def load(cls):
+        types = _setting_types()
+        return cls(types, dict((ident, __addon__.getSetting(ident)) for ident in types))
+
+    def replace(self, ident, value):
+        raw = dict(self._raw)
+        raw[ident] = value
+        return Settings(self._types, raw)
+
+    def converter(self, ident):
+        return self._types.get(ident, str)
+
+    def raw(self, ident):
+        return self._raw[ident]
+
+    def changed(self, other):
+        ''' Returns the set of settings whose values differ from another snapshot '''
+        return set(ident for ident, value in self._raw.items()
+                   if other._raw.get(ident) != value)
+
+    def __getitem__(self, ident):
+        return self._values[ident]
+
+    def __eq__(self, other):
+        return isinstance(other, Settings) and self._raw == other._raw
+
+    def __ne__(self, other):
+        return not self == other
+
+
+_settings = None
+_log_level = 0
+
+def settings():
+    ''' Returns the current settings snapshot, loading it from Kodi on first use '''
+    if _settings is None:
+        reload_settings()
+    return _settings
+
+def reload_settings():
+    global _settings, _log_level
+    _settings = Settings.load()
+    _log_level = _settings['debug'] or 0
+    return _settings
+
 
 def log(message, level=xbmc.LOGNOTICE):
     xbmc.log("{0} v{1}: {2}".format(__id__, __version__, message), level=level)
-       
-def log_normal(message):
-    if int(__addon__.getSetting('debug')) > 0:
-        log(message)
-    
-def log_verbose(message):
-    if int(__addon__.getSetting('debug')) == 2:
-        log(message)
-        
-def log_error(message):
-    log(message, xbmc.LOGERROR)        
+
+def _log_enabled(level):
+    if _settings is None:
+        reload_settings()
+    return _log_level >= level
+
+def log_normal(message, *args):
+    if _log_enabled(LOG_NORMAL):
+        log(message.format(*args) if args else message)
+
+def log_verbose(message, *args):
+    if _log_enabled(LOG_VERBOSE):
+        log(message.format(*args) if args else message)
+
+def log_error(message, *args):
+    log(message.format(*args) if args else message, xbmc.LOGERROR)
+
+class KodiHost(host.Host):
+    ''' Logs and reads settings for the camera core through Kodi '''
+
+    def log_normal(self, message, *args):
+        log_normal(message, *args)
+
+    def log_verbose(self, message, *args):
+        log_verbose(message, *args)
+
+    def log_error(self, message, *args):
+        log_error(message, *args)
+
+    def get_setting(self, ident, default=None):
+        try:
+            return get_setting(ident)
+        except KeyError:
+            return default
+
+host.set_host(KodiHost())
 
 def notify(msg, time=10000):
     xbmcgui.Dialog().notification(addon_name, msg, __icon__, time)
@@ -53,27 +186,54 @@ def get_string(ident):
     return __addon__.getLocalizedString(ident)
 
 def get_setting(ident):
-    return __addon__.getSetting(ident)
+    return settings().raw(ident)
+
+def _get_typed_setting(ident, convert):
+    current = settings()
+    if current.converter(ident) is convert:
+        return current[ident]
+    return convert(current.raw(ident))
 
 def get_bool_setting(ident):
-    return get_setting(ident) == "true"
+    return _get_typed_setting(ident, _to_bool)
 
 def get_int_setting(ident):
-    try:
-        return int(get_setting(ident))
-    except ValueError:
-        return None
+    return _get_typed_setting(ident, _to_int)
 
 def get_float_setting(ident):
-    return float(get_setting(ident))
+    return _get_typed_setting(ident, _to_float)
+
+def camera_setting_id(ident, index):
+    if index == 1:
+        return ident
+    return "{0}_{1}".format(ident, index)
+
+def get_camera_settings(index):
+    ''' Returns the host, port, user name and password of a camera,
+        or None if the camera is not enabled '''
+    if index > 1 and not get_bool_setting(camera_setting_id('camera_enable', index)):
+        return None
+    return (get_setting(camera_setting_id('host', index)),
+            get_int_setting(camera_setting_id('port', index)),
+            get_setting(camera_setting_id('username', index)),
+            get_setting(camera_setting_id('password', index)))
 
 def set_setting(ident, value):
+    global _settings
     __addon__.setSetting(ident, value)
+    _settings = settings().replace(ident, value)
+
+def get_frame_path():
+    ''' Returns the directory for preview frames, which is memory backed if enabled and available '''
+    if get_bool_setting('preview_memory') and os.path.isdir(MEMORY_PATH):
+        return os.path.join(MEMORY_PATH, __id__)
+    return os.path.join(xbmc.translatePath(addon_info('profile')), "snapshots")
 
 def open_settings(callback=None):
     if callback is not None:
         callback()
     __addon__.openSettings()
+    reload_settings()
 
 def invalid_char(credential, chars, stringid, show_dialog):
     for char in chars:
@@ -96,99 +256,223 @@ def error_dialog(msg):
 
 
 class SnapShot(object):
-    def __init__(self, path, interval, get_data):
+    ''' A single snapshot fetch and the time it took '''
+
+    def __init__(self, get_data):
+        self.get_data = get_data
+        self.time = None
+        self.elapsed = None
+        self.data = None
+
+    def fetch(self):
         self.time = time.time()
+        self.data = self.get_data()
+        self.elapsed = time.time() - self.time
+        metrics.observe("snapshot.fetch", self.elapsed)
+        log_verbose("Retrieving snapshot took {0:.2f} seconds", self.elapsed)
+        return self
+
 
-        self.interval = interval
-        self.filename = os.path.join(path, "{0}.jpg".format(self.time))
+class SnapShotSource(object):
+    ''' A frame source with the interface of mjpeg.MJPEGParser which polls snapshots.
 
+        Up to depth snapshots are fetched at once so that the next one downloads while
+        the current one is shown. Fetches are spaced by the measured fetch time divided
+        by the depth, and by the target frame rate if one is given. '''
+
+    def __init__(self, get_data, depth=SNAPSHOT_DEPTH, target_fps=0):
         self.get_data = get_data
+        self.depth = depth
+        self.min_interval = 1.0 / target_fps if target_fps else 0
+
+        self.frames = 0
+        self.skipped_frames = 0
+        self.corrupt_frames = 0
+        self.bytes_read = 0
+        self.latency = None
+
+        self._pool = workers.WorkerPool(depth, name="snapshot")
+        self._pending = collections.deque()
+        self._next_start = 0
+        self._closed = threading.Event()
+
+    def close(self):
+        self._closed.set()
+        self._pool.shutdown()
+
+    def __iter__(self):
+        return iter(self.next_frame, None)
+
+    def next_frame(self, wanted=None):
+        failures = 0
+        while not self._closed.is_set() and failures < MAX_SNAPSHOT_FAILURES:
+            while len(self._pending) < self.depth:
+                self._submit()
+
+            snapshot = self._pending.popleft().result()
+            if snapshot is None:
+                break
+            self._update_latency(snapshot.elapsed)
+            if not snapshot.data:
+                failures += 1
+                self.corrupt_frames += 1
+                continue
+            failures = 0
+
+            if wanted is not None and not wanted():
+                self.skipped_frames += 1
+                continue
+            self.frames += 1
+            self.bytes_read += len(snapshot.data)
+            return snapshot.data
+        return None
+
+    def _submit(self):
+        spacing = max(self.min_interval, (self.latency or 0) / self.depth)
+        start_time = max(time.time(), self._next_start)
+        self._next_start = start_time + spacing
+        self._pending.append(self._pool.submit(self._fetch, start_time))
+
+    def _fetch(self, start_time):
+        if self._closed.wait(max(0, start_time - time.time())):
+            return None
+        return SnapShot(self.get_data).fetch()
+
+    def _update_latency(self, elapsed):
+        if self.latency is None:
+            self.latency = elapsed
+        else:
+            self.latency += LATENCY_WEIGHT * (elapsed - self.latency)
+
+
+class FrameRing(object):
+    ''' A fixed number of reusable files for preview frames.
+
+        Each frame is written to a temporary file which then replaces the oldest slot,
+        so an image control is never given a partly written file. '''
+
+    def __init__(self, path, size=FRAME_SLOTS):
+        self.path = path
+        self.slots = [os.path.join(path, "frame.{0}.jpg".format(i)) for i in range(size)]
+        self._tmp = os.path.join(path, "frame.tmp")
+        self._next = 0
 
     def __enter__(self):
         return self
 
-    def save(self):
-        with open(self.filename, 'wb') as output:
-            log_verbose("Snapshot {0}".format(self.filename))
-            data = self.get_data()
-            if data:
-                output.write(data)
-                return self.filename
+    def write(self, data):
+        filename = self.slots[self._next]
+        with open(self._tmp, 'wb') as output:
+            output.write(data)
+        fileutils.replace_file(self._tmp, filename)
+        self._next = (self._next + 1) % len(self.slots)
+        return filename
+
+    def close(self):
+        for filename in self.slots + [self._tmp]:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
             else:
-                return ""
+                log_verbose("Deleted {0}", filename)
 
     def __exit__(self, exc_type, exc_value, traceback):
-        current_time = time.time()
-        elapsed = current_time - self.time
-        log_verbose("Retrieving snapshot took {0:.2f} seconds".format(elapsed))
-        remaining = int(self.interval - elapsed*1000)
-        sleep = max(200, remaining)
-        log_verbose("Sleeping for {0} milliseconds".format(sleep))
-        xbmc.sleep(sleep)
-        
-        try:
-            os.remove(self.filename)
-        except:
-            pass
-        else:
-            log_verbose("Deleted {0}".format(self.filename))
-
+        self.close()
 
-def get_mjpeg_frame(stream):
-    try:
-        stream.readline()
-        stream.readline()
-        content_length = stream.readline()
-        bytes = int(content_length.split(':')[-1])
-        stream.readline()
-        return stream.read(bytes)
-    except requests.RequestException as e:
-        utils.log_error(str(e))
-        return None
 
 class ExtractMJPEGFrames(object):
-    def __init__(self, path, duration, stream, callback, *args):
+    ''' Shows the frames of an MJPEG stream, or of another frame source with the
+        interface of mjpeg.MJPEGParser, for a fixed duration.
+
+        The stream is read by an mjpeg.FrameReader thread, and the newest frame it has
+        read is shown whenever the next one is due, so a stalled stream does not hold up
+        the preview and slow rendering does not back up the stream. With a target frame
+        rate, frames which arrive before the next one is due are discarded without
+        reading them. '''
+
+    def __init__(self, path, duration, parser, callback, target_fps=0):
         self.path = path
         self.duration = duration
-        self.stream = stream
+        self.parser = parser
         self.callback = callback
-        self.callback_args = args
+        self.interval = 1.0 / target_fps if target_fps else 0
 
-        self._stop = False
+        self.frames = FrameRing(path)
+        self.reader = mjpeg.FrameReader(parser, self._wanted if self.interval else None)
+        self.first_frame_time = None
+        self.key_frame = None
+        self.next_display = 0
+        self.displayed = 0
+        self._stop = threading.Event()
 
     def __enter__(self):
         return self
 
     def stop(self):
-        self._stop = True
+        self._stop.set()
+        self.reader.stop()
+
+    def _due(self):
+        # Take a frame which arrives up to half an interval early rather than wait for the next one
+        return self.next_display - self.interval / 2
+
+    def _wanted(self):
+        return time.time() >= self._due()
+
+    def _show(self, frame, read_time):
+        with metrics.timer("preview.frame_write"):
+            filename = self.frames.write(frame)
+        self.callback(filename)
+        log_verbose("Frame {0}", filename)
+
+        now = time.time()
+        metrics.observe("preview.display_latency", now - read_time)
+        if self.first_frame_time is None:
+            self.first_frame_time = now
+            # Kept for the alarm history, as the frame files are deleted with the preview
+            self.key_frame = frame
+        self.displayed += 1
+        self.next_display = max(self.next_display + self.interval, now - self.interval)
 
     def start(self):
         start_time = time.time()
-        current_time = start_time
-        frames = 0
-        while current_time < start_time + self.duration and not self._stop:
-            xbmc.sleep(1)
-            frame = get_mjpeg_frame(self.stream)
-            if frame:
-                filename = os.path.join(self.path, "snapshot.{0}.jpg".format(time.time()))
-                open(filename, 'w').write(frame)
-                self.callback(filename, *self.callback_args)
-                log_verbose("Snapshot {0}".format(filename))
-            current_time = time.time()
-            frames += 1
-        duration = current_time - start_time
-        log_normal("Average fps: {0:.2f}".format(frames / duration))
+        end_time = start_time + self.duration
+        self.next_display = start_time
+        self.reader.start()
+        while not self._stop.is_set():
+            now = time.time()
+            if now >= end_time:
+                break
+            if now < self._due():
+                self._stop.wait(self._due() - now)
+                continue
+
+            frame, read_time = self.reader.get(end_time - now)
+            if frame is not None:
+                self._show(frame, read_time)
+            elif self.reader.error is not None:
+                log_error("Error reading MJPEG stream: {0}", self.reader.error)
+                break
+            elif self.reader.ended:
+                log_normal("MJPEG stream ended")
+                break
+        self.reader.stop()
+
+        duration = time.time() - start_time
+        dropped = self.reader.replaced + self.parser.skipped_frames
+        log_normal("Average fps: {0:.2f} ({1} decoded, {2} displayed, {3} dropped, {4} corrupt)",
+                   self.displayed / duration, self.parser.frames, self.displayed,
+                   dropped, self.parser.corrupt_frames)
+        metrics.incr("mjpeg.frames", self.parser.frames)
+        metrics.incr("mjpeg.corrupt_frames", self.parser.corrupt_frames)
+        metrics.incr("preview.frames", self.displayed)
+        metrics.incr("preview.dropped_frames", dropped)
         return int(duration)
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.stream.close()
-        for jpg in glob.glob(os.path.join(self.path, "snapshot.*.jpg")):
-            try:
-                os.remove(jpg)
-            except:
-                log_verbose("Unable to delete {0}".format(jpg))
-            else:
-                log_verbose("Deleted {0}".format(jpg))
+        self.reader.stop()
+        self.frames.close()
 
 
 class Monitor(xbmc.Monitor):
@@ -197,6 +481,7 @@ class Monitor(xbmc.Monitor):
         self.updated_settings_callback = updated_settings_callback
 
     def onSettingsChanged(self):
+        reload_settings()
         self.updated_settings_callback()
 
 
@@ -206,14 +491,14 @@ class StopResumePlayer(xbmc.Player):
             self.resume_time = self.getTime()
             self.previous_file = self.getPlayingFile()
             self.stop()
-            log_normal("Stopped {0}".format(self.previous_file))
+            log_normal("Stopped {0}", self.previous_file)
         else:
             self.previous_file = None
 
     def maybe_resume_previous(self):
         if self.previous_file is not None:
             resume_time_str = "{0:.1f}".format(self.resume_time - 10.)
-            log_normal("Resuming {0} at {1}".format(self.previous_file, resume_time_str))
+            log_normal("Resuming {0} at {1}", self.previous_file, resume_time_str)
             listitem = xbmcgui.ListItem()
             listitem.setProperty('StartOffset', resume_time_str)
             self.play(self.previous_file, listitem)
@@ -0,0 +1,74 @@
+import time
+import threading
+import Queue
+
+
+class Task(object):
+    ''' The pending result of a function submitted to a WorkerPool '''
+
+    def __init__(self, func, args, kwargs):
+        self._func = func
+        self._args = args
+        self._kwargs = kwargs
+
+        self._done = threading.Event()
+        self._result = None
+        self._exception = None
+
+    def run(self):
+        try:
+            self._result = self._func(*self._args, **self._kwargs)
+        except Exception as e:
+            self._exception = e
+        finally:
+            self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        self._done.wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+
+class WorkerPool(object):
+    ''' A fixed number of daemon threads which run submitted functions '''
+
+    def __init__(self, size, name="worker"):
+        self._tasks = Queue.Queue()
+        self._threads = []
+        for i in range(size):
+            thread = threading.Thread(target=self._run, name="{0}-{1}".format(name, i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args, **kwargs):
+        task = Task(func, args, kwargs)
+        self._tasks.put(task)
+        return task
+
+    def map(self, func, iterable):
+        tasks = [self.submit(func, item) for item in iterable]
+        return [task.result() for task in tasks]
+
+    def shutdown(self):
+        for thread in self._threads:
+            self._tasks.put(None)
+
+    def join(self, timeout=None):
+        ''' Waits for the threads to end after shutdown, for up to timeout seconds in all.
+            Returns whether they all ended. '''
+        deadline = time.time() + timeout if timeout is not None else None
+        for thread in self._threads:
+            thread.join(max(0, deadline - time.time()) if deadline is not None else None)
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            task.run()
@@ -1,4 +1,8 @@
 import os
+import time
+import socket
+import threading
+import Queue
 
 import xbmc
 import xbmcgui
@@ -7,162 +11,589 @@ import xbmcaddon
 from resources.lib import foscam
 from resources.lib import utils
 from resources.lib import gui
+from resources.lib import workers
+from resources.lib import metrics
+from resources.lib import alarmserver
+from resources.lib import scheduler
+from resources.lib import recorder
+from resources.lib import devicestate
+from resources.lib import motion
+from resources.lib import eventstore
+from resources.lib import requestscheduler
+
+
+class CameraMonitor(object):
+    ''' The camera and alarm state for one configured camera '''
+
+    def __init__(self, index, camera):
+        self.index = index
+        self.camera = camera
+
+        self.alarm_active = False
+        self.duration_shown = 0
+        self.alarm_time = None
+        self.alarm = None
+        self.recorder = None
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return "camera {0}".format(self.index)
+
+    def matches(self, camera, address):
+        ''' Returns whether an alarm notification is for this camera. It must come from the
+            camera's address, as the listener is unauthenticated. The camera parameter only
+            picks between cameras which share an address. '''
+        if camera is not None and camera != str(self.index):
+            return False
+        try:
+            return socket.gethostbyname(self.camera.host) == address
+        except socket.error:
+            return False
+
+    def start_alarm(self, alarm=None):
+        ''' Marks the alarm as active, returning False if it already was.
+            alarm is the kind of alarm if it is known. '''
+        with self._lock:
+            if self.alarm_active:
+                return False
+            self.alarm_active = True
+            self.alarm_time = time.time()
+            self.alarm = alarm
+            return True
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.recorder = None
+
+    def is_playing(self):
+        player = xbmc.Player()
+        return (player.isPlaying()
+                and player.getPlayingFile() in (self.camera.video_url,
+                                                self.camera.mjpeg_url))
+
+    def alarm_check(self, motion_enable, sound_enable):
+        ''' Returns the kind of alarm which is active, False if there is none,
+            or None if the camera could not be reached '''
+        dev_state = self.camera.get_device_state()
+        if not dev_state:
+            return None
+
+        for alarm, enabled in (('motionDetect', motion_enable),
+                               ('sound', sound_enable)):
+            if enabled:
+                param = "{0}Alarm".format(alarm)
+                alarm_status = dev_state[param]
+                utils.log_verbose("{0}: {1:s} = {2:d}", self, param, alarm_status)
+                if alarm_status == 2:
+                    utils.log_normal("Alarm detected on {0}", self)
+                    return alarm
+        return False
+
+
+class PreviewQueue(threading.Thread):
+    ''' Shows alarm previews one at a time in the order the alarms were detected '''
+
+    def __init__(self, show_preview):
+        threading.Thread.__init__(self, name="preview")
+        self.daemon = True
+
+        self.show_preview = show_preview
+        self._queue = Queue.Queue()
+
+    def put(self, monitor):
+        utils.log_verbose("Queueing preview for {0}", monitor)
+        self._queue.put(monitor)
+
+    def stop(self):
+        self._queue.put(None)
+
+    def run(self):
+        while True:
+            monitor = self._queue.get()
+            if monitor is None:
+                break
+            try:
+                self.show_preview(monitor)
+            except Exception as e:
+                utils.log_error("Error showing preview for {0}: {1}", monitor, e)
+
+
+CONNECTION_SETTINGS = ('camera_enable', 'host', 'port', 'username', 'password')
+DETECTION_SETTINGS = ('motion_enable', 'motion_sensitivity', 'motion_trigger_interval',
+                      'motion_verify', 'motion_verify_threshold', 'motion_verify_areas',
+                      'sound_enable', 'sound_sensitivity', 'sound_trigger_interval')
+PREVIEW_SETTINGS = ('check_interval', 'preview_position', 'preview_scaling',
+                    'preview_duration', 'preview_memory', 'preview_fps', 'preview_match_stream')
+LISTENER_SETTINGS = ('listener_enable', 'listener_port', 'listener_address', 'listener_check_interval')
+RECORDING_SETTINGS = ('recording_enable', 'recording_pre_alarm', 'recording_memory',
+                      'recording_max_size')
+
+MEGABYTE = 1024 * 1024
+
+MIN_WAIT = 0.01
+
+# Alarm events and their key frames are kept for this long
+EVENT_MAX_AGE = 30 * 24 * 60 * 60
+PRUNE_INTERVAL = 60 * 60
+PRUNE_PAUSE = 0.1
+
+# How long to wait at exit for a preview or prune to finish with the event store
+SHUTDOWN_TIMEOUT = 5
+
+# Snapshots scored to check a motion alarm before its preview is shown
+VERIFY_FRAMES = 3
+VERIFY_INTERVAL = 0.3
 
 
 class Main(object):
     def __init__(self):
         utils.log_normal("Starting service")
-        self.alarm_active = False
-        self.duration_shown = 0
-        
-        self.configured = self.apply_basic_settings()
+        self.cameras = []
+        profile = xbmc.translatePath(utils.addon_info('profile'))
+        self.device_state = devicestate.DeviceStateStore(os.path.join(profile, "device_state.json"))
+        self.events = eventstore.EventStore(os.path.join(profile, "events.db"))
+        self.event_frames = os.path.join(profile, "events")
+        self.pool = workers.WorkerPool(utils.MAX_CAMERAS, name="alarm-check")
+        self.stream_pool = workers.WorkerPool(1, name="stream")
+        self.event_pool = workers.WorkerPool(1, name="events")
+        self.next_prune = 0
+        self.metrics_dump = None
+        self.apply_metrics_settings()
+        self.listener = None
+        self.scheduler = scheduler.PollScheduler(utils.get_int_setting('check_interval'),
+                                                 log=utils.log_verbose)
+
+        self.apply_connection_settings(range(1, utils.MAX_CAMERAS + 1))
         if self.configured:
             self.init_settings()
-            self.apply_other_settings()
+        self.settings = utils.settings()
+        self.apply_preview_settings()
+        self.apply_detection_settings(self.cameras)
+        self.apply_recording_settings(self.cameras)
 
         self.monitor = utils.Monitor(updated_settings_callback=self.settings_changed)
-        
-        self.path = os.path.join(xbmc.translatePath(utils.addon_info('profile')), "snapshots")
-        try:
-            os.makedirs(self.path)
-        except:
-            pass
 
-        while not xbmc.abortRequested:
-            if self.configured:
-                self.alarm_check()
+        self.previews = PreviewQueue(self.show_preview)
+        self.previews.start()
+        self.apply_listener_settings()
 
-            if self.alarm_active:
-                sleep = foscam.ALARM_DURATION - self.duration_shown + self.trigger_interval
-            else:
-                sleep = self.check_interval
-            utils.log_verbose("Sleeping for {0} seconds".format(sleep))
+        while not self.wait_for_abort(self.scheduler.wait_time()):
+            for monitor in self.scheduler.due():
+                self.pool.submit(self.alarm_check, monitor)
+            if time.time() >= self.next_prune:
+                self.next_prune = time.time() + PRUNE_INTERVAL
+                self.event_pool.submit(self.prune_events)
+
+        if self.listener is not None:
+            self.listener.stop()
+        self.previews.stop()
+        for monitor in self.cameras:
+            monitor.stop_recording()
+        self.pool.shutdown()
+        self.stream_pool.shutdown()
+        self.event_pool.shutdown()
+        for monitor in self.cameras:
+            self.device_state.save(monitor.camera)
+        # A preview or prune which is still running would find the event store closed
+        self.previews.join(SHUTDOWN_TIMEOUT)
+        if self.event_pool.join(SHUTDOWN_TIMEOUT) and not self.previews.is_alive():
+            self.events.close()
+        else:
+            utils.log_normal("Leaving the alarm event store open for a preview or prune which is still running")
+        if self.metrics_dump is not None:
+            self.metrics_dump.stop()
+
+    def wait_for_abort(self, timeout):
+        # waitForAbort treats a timeout of zero as no timeout
+        return self.monitor.waitForAbort(max(MIN_WAIT, timeout))
+
+    @property
+    def configured(self):
+        return bool(self.cameras)
 
-            for i in range(sleep):
-                if not xbmc.abortRequested:
-                    xbmc.sleep(1000)
-    
     def init_settings(self):
         utils.log_normal("Initialising settings from the camera")
+        camera = self.cameras[0].camera
+
+        # Always read from the camera, as its values win over those persisted at an earlier start.
+        # configure_camera then changes the configs just read without reading them again.
+        motion, sound = self.pool.map(lambda get_config: get_config(),
+                                      (camera.get_motion_detect_config, camera.get_sound_detect_config))
+
+        if motion:
+            utils.set_setting('motion_sensitivity', str(motion['sensitivity']))
+            utils.set_setting('motion_trigger_interval', str(motion['triggerInterval']))
+
+        if sound:
+            utils.set_setting('sound_sensitivity', str(sound['sensitivity']))
+            utils.set_setting('sound_trigger_interval', str(sound['triggerInterval']))
+
+        self.device_state.save(camera)
 
-        response = self.camera.get_motion_detect_config()
-        utils.set_setting('motion_sensitivity', str(response['sensitivity']))
-        utils.set_setting('motion_trigger_interval', str(response['triggerInterval']))
-        
-        response = self.camera.get_sound_detect_config()
-        utils.set_setting('sound_sensitivity', str(response['sensitivity']))
-        utils.set_setting('sound_trigger_interval', str(response['triggerInterval']))
-    
     def settings_changed(self):
-        utils.log_normal("Applying settings")
-        self.configured = self.apply_basic_settings()
-        if self.configured:
-            self.apply_other_settings()
-        
-    def apply_basic_settings(self):        
-        self.check_interval = utils.get_int_setting('check_interval')
+        previous, self.settings = self.settings, utils.settings()
+        changed = self.settings.changed(previous)
+        if not changed:
+            return
+        utils.log_normal("Applying settings: {0}", ", ".join(sorted(changed)))
+
+        for monitor in self.cameras:
+            monitor.camera.reset_stream_format()
+
+        self.apply_metrics_settings()
+
+        indexes = [index for index in range(1, utils.MAX_CAMERAS + 1)
+                   if changed.intersection(utils.camera_setting_id(ident, index)
+                                           for ident in CONNECTION_SETTINGS)]
+        connected = self.apply_connection_settings(indexes) if indexes else []
+
+        if changed.intersection(PREVIEW_SETTINGS):
+            self.apply_preview_settings()
+
+        if changed.intersection(LISTENER_SETTINGS):
+            self.apply_listener_settings()
+
+        if changed.intersection(DETECTION_SETTINGS):
+            self.apply_detection_settings(self.cameras)
+        elif connected:
+            self.apply_detection_settings(connected)
+
+        if changed.intersection(RECORDING_SETTINGS):
+            self.apply_recording_settings(self.cameras)
+        elif connected:
+            self.apply_recording_settings(connected)
+
+    def apply_connection_settings(self, indexes):
+        ''' Connects to the cameras at the given indexes, replacing any existing
+            connections to them. Returns the newly connected cameras. '''
+        monitors = dict((monitor.index, monitor) for monitor in self.cameras)
+        connected = []
+        for index, camera in zip(indexes, self.pool.map(self.connect_camera, indexes)):
+            previous = monitors.pop(index, None)
+            if previous is not None:
+                self.scheduler.remove(previous)
+                previous.stop_recording()
+                previous.camera.close()
+            if camera is not None:
+                monitors[index] = CameraMonitor(index, camera)
+                self.scheduler.add(monitors[index])
+                connected.append(monitors[index])
 
-        user = utils.get_setting('username')
-        password = utils.get_setting('password')
-        host = utils.get_setting('host')
-        port = utils.get_int_setting('port')
+        self.cameras = [monitors[index] for index in sorted(monitors)]
+        return connected
+
+    def apply_metrics_settings(self):
+        enabled = utils.get_bool_setting('metrics_enable')
+        if enabled and self.metrics_dump is None:
+            filename = os.path.join(xbmc.translatePath(utils.addon_info('profile')), "metrics.json")
+            utils.log_normal("Writing metrics to {0}", filename)
+            self.metrics_dump = metrics.PeriodicDump(filename)
+            self.metrics_dump.start()
+        elif not enabled and self.metrics_dump is not None:
+            self.metrics_dump.stop()
+            self.metrics_dump = None
+
+    def apply_recording_settings(self, monitors):
+        ''' Starts capturing frames from each camera before alarms if enabled, replacing any existing capture '''
+        enabled = utils.get_bool_setting('recording_enable')
+        path = os.path.join(xbmc.translatePath(utils.addon_info('profile')), "recordings")
+        if enabled and not os.path.isdir(path):
+            os.makedirs(path)
+
+        for monitor in monitors:
+            monitor.stop_recording()
+            if not enabled:
+                continue
+            spool = recorder.MJPEGSpool(path, "camera{0}".format(monitor.index),
+                                        utils.get_int_setting('recording_max_size') * MEGABYTE)
+            monitor.recorder = recorder.PreAlarmRecorder(monitor.camera.get_snapshot, spool,
+                                                         utils.get_int_setting('recording_memory') * MEGABYTE,
+                                                         utils.get_int_setting('recording_pre_alarm'),
+                                                         log=utils.log_verbose,
+                                                         name="recorder-{0}".format(monitor.index))
+            monitor.recorder.start()
+            utils.log_normal("Capturing frames before alarms on {0}", monitor)
+
+    def apply_listener_settings(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+        self.listener_check_interval = utils.get_int_setting('listener_check_interval')
+        if utils.get_bool_setting('listener_enable'):
+            port = utils.get_int_setting('listener_port') or alarmserver.DEFAULT_PORT
+            address = utils.get_setting('listener_address').strip()
+            try:
+                self.listener = alarmserver.AlarmListener(port, self.alarm_notification, address,
+                                                          log=utils.log_verbose)
+            except socket.error as e:
+                utils.log_error("Unable to listen for alarms on {0}:{1}: {2}", address, port, e)
+            else:
+                self.listener.start()
+                utils.log_normal("Listening for alarms on {0}:{1}", address or "*", port)
+        self.scheduler.set_interval(self.poll_interval)
+
+    @property
+    def poll_interval(self):
+        ''' Alarm notifications make polling only a fallback, so it can be much less frequent '''
+        if self.listener is not None:
+            return max(self.check_interval, self.listener_check_interval)
+        return self.check_interval
+
+    def connect_camera(self, index):
+        camera_settings = utils.get_camera_settings(index)
+        if camera_settings is None:
+            return None
+
+        host, port, user, password = camera_settings
 
         if not host:
-            utils.log_normal("No host specified")
-            return False
+            utils.log_normal("No host specified for camera {0}", index)
+            return None
 
         invalid = utils.invalid_user_char(user)
         if invalid:
             utils.log_error("Invalid character in user name: " + invalid)
-            return False
+            return None
 
         invalid = utils.invalid_password_char(password)
         if invalid:
             utils.log_error("Invalid character in password: " + invalid)
-            return False
+            return None
 
-        self.camera = foscam.Camera(host, port, user, password)
-        success, msg = self.camera.test()
+        camera = foscam.Camera(host, port, user, password)
+        self.device_state.load(camera)
+        success, msg = camera.test()
         if not success:
-            utils.log_error(msg)
-            return False
+            utils.log_error("Camera {0}: {1}", index, msg)
+            camera.close()
+            return None
 
-        return True
+        # Set the stream format now rather than when the first alarm is raised
+        camera.enable_mjpeg()
+        return camera
 
-    def apply_other_settings(self):            
-        self.motion_enable = utils.get_bool_setting('motion_enable')
-        self.sound_enable = utils.get_bool_setting('sound_enable')
+    def apply_preview_settings(self):
+        self.check_interval = utils.get_int_setting('check_interval')
+        self.scheduler.set_interval(self.poll_interval)
 
         self.duration = utils.get_int_setting('preview_duration')
         self.scaling = utils.get_float_setting('preview_scaling')
         self.position = utils.get_setting('preview_position').lower()
+        self.target_fps = utils.get_int_setting('preview_fps')
+        self.match_stream = utils.get_bool_setting('preview_match_stream')
+
+        self.path = utils.get_frame_path()
+        try:
+            os.makedirs(self.path)
+        except:
+            pass
+
+    def apply_detection_settings(self, monitors):
+        self.motion_enable = utils.get_bool_setting('motion_enable')
+        self.sound_enable = utils.get_bool_setting('sound_enable')
+
+        self.motion_trigger_interval = utils.get_int_setting('motion_trigger_interval')
+        self.sound_trigger_interval = utils.get_int_setting('sound_trigger_interval')
 
-        motion_trigger_interval = utils.get_int_setting('motion_trigger_interval')
-        sound_trigger_interval = utils.get_int_setting('sound_trigger_interval')
-        
         if self.motion_enable and self.sound_enable:
-            self.trigger_interval = min(motion_trigger_interval, sound_trigger_interval)
+            self.trigger_interval = min(self.motion_trigger_interval, self.sound_trigger_interval)
         elif self.motion_enable:
-            self.trigger_interval = motion_trigger_interval
+            self.trigger_interval = self.motion_trigger_interval
         elif self.sound_enable:
-            self.trigger_interval = sound_trigger_interval
-        
+            self.trigger_interval = self.sound_trigger_interval
+
+        self.apply_motion_verify_settings()
+        self.pool.map(self.configure_camera, [monitor.camera for monitor in monitors])
+
+    def apply_motion_verify_settings(self):
+        self.motion_scorer = None
+        if not (self.motion_enable and utils.get_bool_setting('motion_verify')):
+            return
+        if not motion.available():
+            utils.log_error("Checking motion needs the NumPy and PIL modules")
+            return
+
+        try:
+            areas = motion.parse_areas(utils.get_setting('motion_verify_areas'))
+        except ValueError as e:
+            utils.log_error("Checking motion in the whole frame: {0}", e)
+            areas = []
+        self.motion_scorer = motion.MotionScorer(areas)
+        self.motion_threshold = utils.get_int_setting('motion_verify_threshold') / 100.0
+
+    def configure_camera(self, camera):
         if self.motion_enable:
-            command = self.camera.set_motion_detect_config()
+            command = camera.set_motion_detect_config()
             command['isEnable'] = 1
             command['sensitivity'] = utils.get_int_setting('motion_sensitivity')
-            command['triggerInterval'] = motion_trigger_interval
+            command['triggerInterval'] = self.motion_trigger_interval
             self.send_command(command)
-            
+
         if self.sound_enable:
-            command = self.camera.set_sound_detect_config()
+            command = camera.set_sound_detect_config()
             command['isEnable'] = 1
             command['sensitivity'] = utils.get_int_setting('sound_sensitivity')
-            command['triggerInterval'] = sound_trigger_interval
-            
+            command['triggerInterval'] = self.sound_trigger_interval
+
             for iday in range(7):
                 command['schedule{0:d}'.format(iday)] = 2**48 - 1
             self.send_command(command)
-            
+
     def send_command(self, command):
         response = command.send()
         if not response:
-            msg = u"{0}: {1}".format(utils.get_string(32104), response.message)
+            msg = utils.get_string(32104)
+            if response is not False:
+                msg = u"{0}: {1}".format(msg, response.message)
             utils.notify(msg)
 
-    def alarm_check(self):
-        if self.motion_enable or self.sound_enable:
-            player = xbmc.Player()
-            if (player.isPlaying()
-                and player.getPlayingFile() in (self.camera.video_url,
-                                                self.camera.mjpeg_url)):
+    def alarms_enabled(self, monitor):
+        return (self.motion_enable or self.sound_enable) and not monitor.is_playing()
+
+    def trigger_alarm(self, monitor, alarm=None):
+        if monitor.start_alarm(alarm):
+            if monitor.recorder is not None:
+                monitor.recorder.record(self.duration)
+            self.previews.put(monitor)
+            # The camera will not raise another alarm until its trigger interval has passed.
+            # The trigger interval comes from the camera and is kept in step with the settings.
+            self.scheduler.alarm(monitor, foscam.ALARM_DURATION + self.trigger_interval)
+            return True
+        return False
+
+    def alarm_check(self, monitor):
+        reachable = True
+        try:
+            if not monitor.camera.available:
+                # Polling resumes once the camera's retry time has passed
+                reachable = False
+            elif self.alarms_enabled(monitor):
+                alarm = monitor.alarm_check(self.motion_enable, self.sound_enable)
+                reachable = alarm is not None
+                if alarm:
+                    self.trigger_alarm(monitor, alarm)
+        except Exception as e:
+            utils.log_error("Error checking {0}: {1}", monitor, e)
+            reachable = False
+        finally:
+            self.scheduler.completed(monitor, reachable)
+
+    def alarm_notification(self, camera, address):
+        monitor = next((monitor for monitor in self.cameras if monitor.matches(camera, address)), None)
+        if monitor is None:
+            utils.log_normal("Alarm notification from unknown camera {0} ({1})", camera, address)
+            return False
+
+        metrics.registry.incr("alarm.notifications")
+        if self.alarms_enabled(monitor) and self.trigger_alarm(monitor):
+            utils.log_normal("Alarm notification from {0}", monitor)
+        return True
+
+    def motion_confirmed(self, monitor):
+        ''' Returns whether the alarm's preview should be shown. If enabled, motion alarms
+            are checked by scoring motion in a few snapshots, as changes in lighting often
+            set them off. Alarm notifications do not say what kind they are, so they are
+            checked too, unless only sound alarms are enabled. '''
+        scorer = self.motion_scorer
+        if scorer is None or monitor.alarm == 'sound':
+            return True
+
+        frames = []
+        for i in range(VERIFY_FRAMES):
+            if i:
+                time.sleep(VERIFY_INTERVAL)
+            frames.append(monitor.camera.get_snapshot())
+        score = scorer.score(frames)
+        if score is None:
+            utils.log_normal("Unable to check motion on {0}", monitor)
+            return True
+
+        utils.log_normal("Motion score {0:.3f} on {1}", score, monitor)
+        if score < self.motion_threshold:
+            metrics.registry.incr("alarm.motion_rejected")
+            return False
+        return True
+
+    def open_stream(self, monitor):
+        ''' Returns the frame source for a preview and the command which restores the sub stream,
+            if it was matched to the preview size. Cameras with a broken MJPEG sub stream
+            can be set to poll snapshots instead. '''
+        camera = monitor.camera
+        if utils.get_bool_setting(utils.camera_setting_id('preview_snapshots', monitor.index)):
+            return utils.SnapShotSource(lambda: camera.get_snapshot(requestscheduler.INTERACTIVE),
+                                         target_fps=self.target_fps), None
+
+        profile = None
+        if self.match_stream:
+            profile = camera.set_preview_stream(int(gui.CameraPreview.WIDTH * self.scaling),
+                                                int(gui.CameraPreview.HEIGHT * self.scaling),
+                                                self.target_fps)
+        return camera.get_mjpeg_stream(), profile
+
+    def prune_events(self):
+        count = self.events.prune(EVENT_MAX_AGE, PRUNE_PAUSE, self.monitor.abortRequested)
+        if count:
+            utils.log_normal("Deleted {0} old alarm events", count)
+
+    def record_event(self, monitor, duration, key_frame):
+        ''' Adds a previewed alarm to the event history, saving the first frame of its preview '''
+        filename = None
+        if key_frame is not None:
+            if not os.path.isdir(self.event_frames):
+                os.makedirs(self.event_frames)
+            filename = os.path.join(self.event_frames, "camera{0}-{1}.jpg".format(
+                monitor.index, time.strftime("%Y%m%d-%H%M%S", time.localtime(monitor.alarm_time))))
+            with open(filename, 'wb') as output:
+                output.write(key_frame)
+        self.events.add(devicestate.camera_key(monitor.camera), monitor.alarm_time,
+                        monitor.alarm, duration, filename)
+
+    def show_preview(self, monitor):
+        profile = None
+        duration = None
+        key_frame = None
+        try:
+            if monitor.is_playing():
+                return
+            if not monitor.camera.available:
+                utils.log_verbose("Not showing preview of unreachable {0}", monitor)
+                return
+            if not self.motion_confirmed(monitor):
+                utils.log_normal("Not showing preview of {0} without enough motion", monitor)
                 return
 
-            self.alarm_active = False
-            
-            dev_state = self.camera.get_device_state()
-            if dev_state:
-                for alarm, enabled in (('motionDetect', self.motion_enable),
-                                       ('sound', self.sound_enable)):
-                    if enabled:
-                        param = "{0}Alarm".format(alarm)
-                        alarm_status = dev_state[param]
-                        utils.log_verbose("{0:s} = {1:d}".format(param, alarm_status))
-                        if alarm_status == 2:
-                            self.alarm_active = True
-                            utils.log_normal("Alarm detected")
-                            break
+            # Connect to the stream while the preview window is built and slides in
+            stream = self.stream_pool.submit(self.open_stream, monitor)
+            preview = gui.CameraPreview(self.duration, self.path,
+                                        self.scaling, self.position,
+                                        None, monitor.index, self.target_fps)
+            preview.show()
+            preview.frame_source, profile = stream.result()
+            utils.log_verbose("Stream ready {0:.2f} seconds after alarm on {1}",
+                              time.time() - monitor.alarm_time, monitor)
 
-            if self.alarm_active:
-                mjpeg_stream = self.camera.get_mjpeg_stream()
-                preview = gui.CameraPreview(self.duration, self.path,
-                                            self.scaling, self.position,
-                                            mjpeg_stream)
-                preview.show()
-                self.duration_shown = preview.start()
-                del(preview)
+            if preview.frame_source is None:
+                preview.close()
+            else:
+                duration = monitor.duration_shown = preview.start()
+                key_frame = preview.key_frame
+                if preview.first_frame_time is not None:
+                    latency = preview.first_frame_time - monitor.alarm_time
+                    metrics.registry.observe("alarm.first_frame", latency)
+                    utils.log_normal("First frame {0:.2f} seconds after alarm on {1}", latency, monitor)
+            del(preview)
+        finally:
+            try:
+                if profile is not None:
+                    profile.restore()
+                # Alarms which were skipped or rejected as false alarms are left out of the history
+                if duration is not None:
+                    self.record_event(monitor, duration, key_frame)
+            finally:
+                monitor.alarm_active = False
 
 
 if __name__ == "__main__":
     Main()
-
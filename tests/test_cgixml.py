@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'lib'))
+
+from cgixml import CameraXMLResponse, unescape
+
+
+ESCAPED = '''<CGI_Result>
+    <result>0</result>
+    <devName>Tom&#39;s &#x26; Jerry&apos;s</devName>
+    <osdText>&lt;Front&gt; &quot;door&quot;</osdText>
+    <literal>&amp;lt; &amp;#38;</literal>
+    <number>&#49;2</number>
+</CGI_Result>
+'''
+
+
+class UnescapeTest(unittest.TestCase):
+    def test_character_references(self):
+        self.assertEqual(unescape("&#39;&#x26;&#X41;&#x4a;"), "'&&#X41;J")
+
+    def test_decoded_ampersand_is_not_decoded_again(self):
+        self.assertEqual(unescape("&amp;lt;&amp;#39;"), "&lt;&#39;")
+
+    def test_invalid_reference_is_kept(self):
+        self.assertEqual(unescape("&#99999999; &nbsp;"), "&#99999999; &nbsp;")
+
+    def test_flat_matches_tree(self):
+        # The tree parser is the reference for how a response is unescaped
+        response = CameraXMLResponse(ESCAPED)
+        tree = CameraXMLResponse(ESCAPED, flat=False)
+        self.assertEqual(list(response.items()), list(tree.items()))
+        self.assertEqual(response['devName'], "Tom's & Jerry's")
+
+
+if __name__ == '__main__':
+    unittest.main()
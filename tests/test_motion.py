@@ -0,0 +1,30 @@
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'lib'))
+
+import motion
+
+
+def jpeg(width, height, shade):
+    from PIL import Image
+    output = io.BytesIO()
+    Image.new('L', (width, height), shade).save(output, 'JPEG')
+    return output.getvalue()
+
+
+@unittest.skipUnless(motion.available(), "NumPy and PIL are needed to score motion")
+class MotionScorerTest(unittest.TestCase):
+    def test_area_smaller_than_a_pixel(self):
+        # Decoded at an eighth of 640x360, the area is less than a pixel wide and high
+        areas = motion.parse_areas("50,50,50.1,50.1")
+        scorer = motion.MotionScorer(areas, size=(1, 1))
+        frames = [jpeg(640, 360, 100), jpeg(640, 360, 100)]
+        self.assertEqual(motion.decode(frames[0], (1, 1)).shape, (45, 80))
+        self.assertEqual(scorer.score(frames), 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+''' End to end benchmarks of the addon against a local mock camera, without Kodi.
+
+    Reports the latency percentiles of CGI commands, the number of MJPEG frames parsed
+    a second, the rate at which a preview shows frames, the rate of a snapshot preview
+    against fetching snapshots one after another, and the time from a camera alarm
+    to the first preview frame through the service, both when the alarm is found by
+    polling and when the camera sends a notification.
+
+    python tools/benchmark_e2e.py --latency 0.02 --jitter 0.01 --error-rate 0.01 '''
+
+import argparse
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+TOOLS_PATH = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, TOOLS_PATH)
+sys.path.insert(0, os.path.join(TOOLS_PATH, '..'))
+
+import kodi_stubs
+from mock_camera import MockCamera, CONFIGS, cgi_result
+
+
+UNLIMITED_RATE = 1e6
+
+
+def percentile(values, percent):
+    ''' Returns the nearest rank percentile of a sorted list '''
+    if not values:
+        return None
+    rank = max(1, int(round(percent / 100.0 * len(values))))
+    return values[rank - 1]
+
+
+def report(name, values, unit="ms", scale=1000):
+    values = sorted(values)
+    if not values:
+        print("{0}: no samples".format(name))
+        return
+    print("{0}: {1} samples, p50 {2:.1f} {6}, p90 {3:.1f} {6}, p99 {4:.1f} {6}, max {5:.1f} {6}".format(
+          name, len(values), percentile(values, 50) * scale, percentile(values, 90) * scale,
+          percentile(values, 99) * scale, values[-1] * scale, unit))
+
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def benchmark_commands(camera, number):
+    from resources.lib import cgixml
+
+    for cmd in ('getDevState', 'getMotionDetectConfig'):
+        latencies = []
+        errors = 0
+        for i in range(number):
+            start = time.time()
+            response = camera.send_command(cmd)
+            if response:
+                latencies.append(time.time() - start)
+            else:
+                errors += 1
+        report("{0} ({1} errors)".format(cmd, errors), latencies)
+
+    xml = cgi_result(0, CONFIGS['getDevState'])
+    start = time.time()
+    for i in range(number):
+        cgixml.CameraXMLResponse(xml)
+    print("CameraXMLResponse: {0:.1f} us per response".format((time.time() - start) / number * 1e6))
+
+
+def benchmark_stream(camera, duration):
+    parser = camera.get_mjpeg_stream()
+    if parser is None:
+        print("Stream: unable to connect")
+        return
+    start = time.time()
+    try:
+        while time.time() - start < duration and parser.next_frame() is not None:
+            pass
+    finally:
+        parser.close()
+    elapsed = time.time() - start
+    print("Stream: {0} frames ({1} corrupt) in {2:.1f} s, {3:.0f} frames/s, {4:.1f} MB/s".format(
+          parser.frames, parser.corrupt_frames, elapsed, parser.frames / elapsed,
+          parser.bytes_read / elapsed / 1e6))
+
+
+def benchmark_preview(camera, duration, target_fps):
+    from resources.lib import utils
+
+    def display_latency():
+        latency = utils.metrics.snapshot()['histograms'].get('preview.display_latency', {})
+        return latency.get('count', 0), latency.get('sum', 0.0)
+
+    path = tempfile.mkdtemp(prefix="frames-")
+    shown = []
+    count, total = display_latency()
+    try:
+        with utils.ExtractMJPEGFrames(path, duration, camera.get_mjpeg_stream(), shown.append,
+                                      target_fps) as extract:
+            extract.start()
+        print("Preview at {0}: {1} decoded, {2} shown, {3} dropped, {4:.1f} frames/s shown".format(
+              "{0} fps".format(target_fps) if target_fps else "camera rate",
+              extract.parser.frames, extract.displayed,
+              extract.reader.replaced + extract.parser.skipped_frames, extract.displayed / float(duration)))
+        new_count, new_total = display_latency()
+        if new_count > count:
+            print("Frame read to shown: mean {0:.1f} ms".format((new_total - total) / (new_count - count) * 1000))
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def benchmark_snapshots(mock, latency, duration):
+    ''' Compares the snapshot preview with fetching one snapshot after another, through a
+        camera with the request scheduler the service uses and snapshots taking latency seconds '''
+    from resources.lib import foscam
+    from resources.lib import utils
+    from resources.lib import requestscheduler
+
+    def get_snapshot():
+        return camera.get_snapshot(requestscheduler.INTERACTIVE)
+
+    camera = foscam.Camera('127.0.0.1', mock.port, mock.user, mock.password)
+    mock_latency, mock.latency = mock.latency, latency
+    try:
+        frames = 0
+        start = time.time()
+        while time.time() - start < duration:
+            if get_snapshot():
+                frames += 1
+        serial = frames / (time.time() - start)
+
+        source = utils.SnapShotSource(get_snapshot)
+        start = time.time()
+        try:
+            while time.time() - start < duration and source.next_frame() is not None:
+                pass
+        finally:
+            source.close()
+        pipelined = source.frames / (time.time() - start)
+    finally:
+        mock.latency = mock_latency
+        camera.close()
+    print("Snapshots at {0:.0f} ms: {1:.1f} frames/s one after another, {2:.1f} frames/s with {3} in flight".format(
+          latency * 1000, serial, pipelined, source.depth))
+
+
+def wait_for_frame(since, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        frames = [shown for shown, filename in kodi_stubs.shown_images if shown >= since]
+        if frames:
+            return frames[0]
+        time.sleep(0.005)
+    return None
+
+
+def benchmark_alarms(mock, runs, preview_duration):
+    import service
+    from resources.lib import utils
+
+    kodi_stubs.Addon.settings.update({'check_interval': '1',
+                                      'preview_duration': str(preview_duration)})
+    utils.reload_settings()
+    main = threading.Thread(target=service.Main, name="service")
+    main.daemon = True
+    main.start()
+    time.sleep(1)
+
+    try:
+        start = time.time()
+        mock.trigger_alarm()
+        shown = wait_for_frame(start, timeout=30)
+        if shown is None:
+            print("Alarm by polling: no frame shown")
+        else:
+            print("Alarm by polling: first frame after {0:.0f} ms".format((shown - start) * 1000))
+        time.sleep(preview_duration + 1)
+
+        listener_port = free_port()
+        kodi_stubs.change_settings({'listener_enable': 'true',
+                                    'listener_port': str(listener_port)})
+        latencies = []
+        for i in range(runs):
+            start = time.time()
+            urlopen("http://127.0.0.1:{0}/alarm?camera=1".format(listener_port), timeout=5).read()
+            shown = wait_for_frame(start, timeout=10)
+            if shown is not None:
+                latencies.append(shown - start)
+            time.sleep(preview_duration + 0.5)
+        report("Alarm by notification to first frame", latencies)
+    finally:
+        kodi_stubs.abort_event.set()
+        main.join(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.01, help="camera response delay in seconds")
+    parser.add_argument('--jitter', type=float, default=0.005, help="random variation of the delay in seconds")
+    parser.add_argument('--frame-size', type=int, default=30000, help="bytes per streamed frame")
+    parser.add_argument('--fps', type=float, default=15, help="camera frame rate for the preview and alarms")
+    parser.add_argument('--error-rate', type=float, default=0, help="chance of a camera request failing")
+    parser.add_argument('--commands', type=int, default=200, help="number of each command to send")
+    parser.add_argument('--duration', type=int, default=3, help="seconds to read the stream and preview for")
+    parser.add_argument('--target-fps', type=int, default=5, help="preview frame rate to also measure")
+    parser.add_argument('--snapshot-latency', type=float, default=0.1, help="snapshot response delay in seconds")
+    parser.add_argument('--alarms', type=int, default=5, help="number of alarm notifications")
+    args = parser.parse_args()
+
+    mock = MockCamera(latency=args.latency, jitter=args.jitter, frame_size=args.frame_size,
+                      fps=args.fps, error_rate=args.error_rate, seed=1)
+    mock.start()
+    kodi_stubs.install({'host': '127.0.0.1', 'port': str(mock.port),
+                        'username': mock.user, 'password': mock.password})
+
+    from resources.lib import foscam
+
+    # Without a rate limit, so that command latencies measure the camera rather than the request scheduler
+    camera = foscam.Camera('127.0.0.1', mock.port, mock.user, mock.password,
+                           max_requests=foscam.POOL_SIZE, request_rate=UNLIMITED_RATE)
+    try:
+        benchmark_commands(camera, args.commands)
+
+        fps, mock.fps = mock.fps, 0
+        benchmark_stream(camera, args.duration)
+        mock.fps = fps
+
+        benchmark_preview(camera, args.duration, 0)
+        if args.target_fps:
+            benchmark_preview(camera, args.duration, args.target_fps)
+        benchmark_snapshots(mock, args.snapshot_latency, args.duration)
+
+        benchmark_alarms(mock, args.alarms, args.duration)
+    finally:
+        camera.close()
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
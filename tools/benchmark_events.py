@@ -0,0 +1,74 @@
+''' Measures alarm event history queries and pruning on a large generated history.
+
+    Events are spread evenly over the given number of days and cameras in a temporary
+    database. The time to find the last day of events for one camera is reported with
+    the query plan, followed by the time taken by each batch when the oldest half of
+    the history is pruned. '''
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'lib'))
+
+import eventstore
+
+
+DAY = 24 * 60 * 60
+
+
+def fill(store, events, days, cameras):
+    now = time.time()
+    spacing = days * DAY / float(events)
+    rows = [("camera{0}".format(i % cameras), now - days * DAY + i * spacing,
+             ('motionDetect', 'sound')[i % 2], 10, None) for i in range(events)]
+    with store._connection:
+        store._connection.executemany(
+            "INSERT INTO events (camera, time, kind, duration, frame) VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--events', type=int, default=300000)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--cameras', type=int, default=3)
+    parser.add_argument('--number', type=int, default=100)
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp(prefix="events-")
+    try:
+        store = eventstore.EventStore(os.path.join(path, "events.db"))
+        start = time.time()
+        fill(store, args.events, args.days, args.cameras)
+        print("Added {0} events in {1:.2f} s".format(args.events, time.time() - start))
+
+        plan = store._connection.execute("EXPLAIN QUERY PLAN SELECT * FROM events "
+                                         "WHERE time >= ? AND camera = ? ORDER BY time DESC",
+                                         (0, "camera0")).fetchall()
+        print("Query plan: " + "; ".join(str(row[-1]) for row in plan))
+        found = len(store.recent("camera0", DAY))
+        times = timeit.repeat(lambda: store.recent("camera0", DAY), number=args.number, repeat=3)
+        print("Last day for one camera: {0} events in {1:.2f} ms".format(found, min(times) / args.number * 1000))
+
+        batches = []
+        before = time.time() - args.days * DAY / 2
+        while True:
+            start = time.time()
+            count = store.prune_batch(before)
+            batches.append(time.time() - start)
+            if count < store.batch_size:
+                break
+        batches.sort()
+        print("Pruned in {0} batches of {1}: median {2:.2f} ms, max {3:.2f} ms".format(
+              len(batches), store.batch_size, batches[len(batches) // 2] * 1000, batches[-1] * 1000))
+        store.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+''' Measures the import time of the camera core and checks that it does not import Kodi modules.
+
+    Each module is imported in a new interpreter, so nothing is cached between runs.
+    The exit status is 1 if a module imports xbmc, xbmcaddon or xbmcgui, or takes
+    longer than the budget given with --budget. '''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+LIB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'lib')
+
+CORE_MODULES = ('host', 'mjpeg', 'cgixml', 'metrics', 'circuitbreaker', 'foscam')
+
+MEASURE = '''
+import json, sys, time
+sys.path.insert(0, {path!r})
+start = time.time()
+import {module}
+elapsed = time.time() - start
+kodi = sorted(name for name in sys.modules if name.startswith('xbmc'))
+sys.stdout.write(json.dumps([elapsed, kodi]))
+'''
+
+
+def measure(module):
+    output = subprocess.check_output([sys.executable, '-c', MEASURE.format(path=LIB_PATH, module=module)])
+    return json.loads(output.decode('utf-8'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('modules', nargs='*', default=CORE_MODULES)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--budget', type=float, help="maximum import time in milliseconds")
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        results = [measure(module) for i in range(args.repeat)]
+        times = sorted(elapsed for elapsed, kodi in results)
+        kodi = results[0][1]
+        median = times[len(times) // 2] * 1000
+        print("{0:<10} median {1:6.1f} ms, best {2:6.1f} ms{3}".format(
+              module, median, times[0] * 1000, ", imports " + ", ".join(kodi) if kodi else ""))
+        if kodi or (args.budget is not None and median > args.budget):
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
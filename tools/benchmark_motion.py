@@ -0,0 +1,78 @@
+''' Measures the time taken to decode camera frames and score motion between them.
+
+    Snapshots saved from a camera can be given on the command line, e.g. with
+    curl "http://camera:88/cgi-bin/CGIProxy.fcgi?cmd=snapPicture2&usr=admin&pwd=" > snapshot.jpg
+    Without any files, noisy frames with a moving square are generated at the camera's
+    resolutions. Decoding at full size is measured too for comparison. Needs NumPy and PIL. '''
+
+import argparse
+import io
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'lib'))
+
+import motion
+
+
+RESOLUTIONS = ((640, 360), (1280, 720), (1920, 1080))
+FULL_SIZE = (100000, 100000)
+
+
+def synthetic_frames(size, count=4, quality=80):
+    import numpy
+    from PIL import Image
+
+    width, height = size
+    random = numpy.random.RandomState(1)
+    frames = []
+    for i in range(count):
+        pixels = random.randint(90, 110, (height, width)).astype(numpy.uint8)
+        side = height // 5
+        left = i * side
+        pixels[side:2 * side, left:left + side] = 220
+        output = io.BytesIO()
+        Image.fromarray(pixels).convert('RGB').save(output, 'JPEG', quality=quality)
+        frames.append(output.getvalue())
+    return frames
+
+
+def benchmark(name, frames, number):
+    scorer = motion.MotionScorer()
+    height, width = motion.decode(frames[0]).shape
+    full_height, full_width = motion.decode(frames[0], FULL_SIZE).shape
+    decode = timeit.repeat(lambda: motion.decode(frames[0]), number=number, repeat=3)
+    full = timeit.repeat(lambda: motion.decode(frames[0], FULL_SIZE), number=number, repeat=3)
+    score = timeit.repeat(lambda: scorer.score(frames), number=number, repeat=3)
+    print("{0} ({1}x{2}, {3} KB)".format(name, full_width, full_height, len(frames[0]) // 1024))
+    print("  decode {0:7.2f} ms at {1}x{2}, {3:7.2f} ms at full size".format(
+          min(decode) / number * 1000, width, height, min(full) / number * 1000))
+    print("  decode and score {0:7.2f} ms per frame, score {1:.3f}".format(
+          min(score) / number / len(frames) * 1000, scorer.score(frames)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('frames', nargs='*', help="JPEG snapshots, scored in the order given")
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    if not motion.available():
+        sys.exit("NumPy and PIL are needed to score motion")
+
+    if len(args.frames) == 1:
+        sys.exit("At least two frames are needed to score motion")
+    if args.frames:
+        frames = []
+        for filename in args.frames:
+            with open(filename, 'rb') as f:
+                frames.append(f.read())
+        benchmark(", ".join(args.frames), frames, args.number)
+    else:
+        for size in RESOLUTIONS:
+            benchmark("Generated", synthetic_frames(size), args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+''' Measures the time taken to parse CGI XML responses and read their values.
+
+    Recorded responses can be given on the command line, e.g. one saved with
+    curl "http://camera:88/cgi-bin/CGIProxy.fcgi?cmd=getDevState&usr=admin&pwd=" > getDevState.xml
+    Without any files a set of sample responses is used. '''
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'resources', 'lib'))
+
+from cgixml import CameraXMLResponse
+
+
+SAMPLES = {
+'getDevState': b'''<CGI_Result>
+    <result>0</result>
+    <IOAlarm>0</IOAlarm>
+    <motionDetectAlarm>1</motionDetectAlarm>
+    <soundAlarm>1</soundAlarm>
+    <record>0</record>
+    <sdState>0</sdState>
+    <sdFreeSpace>0k</sdFreeSpace>
+    <sdTotalSpace>0k</sdTotalSpace>
+    <ntpState>1</ntpState>
+    <ddnsState>0</ddnsState>
+    <url>http%3A%2F%2F</url>
+    <upnpState>0</upnpState>
+    <isWifiConnected>0</isWifiConnected>
+    <wifiConnectedAP></wifiConnectedAP>
+    <infraLedState>0</infraLedState>
+</CGI_Result>
+''',
+'getMotionDetectConfig': b'''<CGI_Result>
+    <result>0</result>
+    <isEnable>1</isEnable>
+    <linkage>0</linkage>
+    <snapInterval>1</snapInterval>
+    <sensitivity>1</sensitivity>
+    <triggerInterval>15</triggerInterval>
+    <schedule0>281474976710655</schedule0>
+    <schedule1>281474976710655</schedule1>
+    <schedule2>281474976710655</schedule2>
+    <schedule3>281474976710655</schedule3>
+    <schedule4>281474976710655</schedule4>
+    <schedule5>281474976710655</schedule5>
+    <schedule6>281474976710655</schedule6>
+    <area0>1023</area0>
+    <area1>1023</area1>
+    <area2>1023</area2>
+    <area3>1023</area3>
+    <area4>1023</area4>
+    <area5>1023</area5>
+    <area6>1023</area6>
+    <area7>1023</area7>
+    <area8>1023</area8>
+    <area9>1023</area9>
+</CGI_Result>
+''',
+'getDevInfo': b'''<CGI_Result>
+    <result>0</result>
+    <productName>FI9821W</productName>
+    <serialNo>0000000000000001</serialNo>
+    <devName>Front%20door</devName>
+    <mac>C4D655000000</mac>
+    <year>2014</year>
+    <mon>6</mon>
+    <day>1</day>
+    <hour>12</hour>
+    <min>0</min>
+    <sec>0</sec>
+    <timeZone>0</timeZone>
+    <firmwareVer>1.11.1.18</firmwareVer>
+    <hardwareVer>1.4.1.10</hardwareVer>
+</CGI_Result>
+''',
+}
+
+
+def read_all(response):
+    return list(response.items())
+
+
+def benchmark(name, xml, number):
+    print(name)
+    for flat in (True, False):
+        parse = timeit.repeat(lambda: CameraXMLResponse(xml, flat=flat), number=number, repeat=3)
+        response = CameraXMLResponse(xml, flat=flat)
+        access = timeit.repeat(lambda: read_all(response), number=number, repeat=3)
+        print("  {0:<6} parse {1:7.2f} us, read all values {2:7.2f} us".format(
+              "flat" if flat else "tree", min(parse) / number * 1e6, min(access) / number * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('responses', nargs='*', help="recorded CGI responses")
+    parser.add_argument('--number', type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.responses:
+        for filename in args.responses:
+            with open(filename, 'rb') as f:
+                benchmark(filename, f.read(), args.number)
+    else:
+        for name, xml in sorted(SAMPLES.items()):
+            benchmark(name, xml, args.number)
+
+
+if __name__ == "__main__":
+    main()
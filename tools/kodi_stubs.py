@@ -0,0 +1,161 @@
+''' Stand-ins for the xbmc, xbmcaddon and xbmcgui modules so that the addon can run headless.
+
+    install() must be called before any addon module is imported. Settings start from
+    the defaults in resources/settings.xml and can be overridden, and change_settings()
+    changes them while the addon runs. Every image shown
+    in an image control is recorded with its time in shown_images. '''
+
+import os
+import sys
+import time
+import types
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+
+
+ADDON_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ADDON_ID = 'script.foscam'
+
+abort_event = threading.Event()
+monitors = []
+shown_images = []
+log_messages = []
+
+
+def default_settings():
+    settings = {}
+    for setting in ET.parse(os.path.join(ADDON_PATH, 'resources', 'settings.xml')).iter('setting'):
+        if setting.get('id'):
+            settings[setting.get('id')] = setting.get('default', '')
+    return settings
+
+
+class Addon(object):
+    settings = {}
+    profile = None
+
+    def __init__(self, id=None):
+        pass
+
+    def getAddonInfo(self, info):
+        if info == 'icon':
+            # Kodi returns byte strings, which the addon decodes
+            return os.path.join(ADDON_PATH, 'icon.png').encode('utf-8')
+        return {'id': ADDON_ID,
+                'name': "Foscam HD",
+                'version': "0.0.0",
+                'path': ADDON_PATH,
+                'profile': self.profile}.get(info, '')
+
+    def getSetting(self, id):
+        return self.settings.get(id, '')
+
+    def setSetting(self, id, value):
+        self.settings[id] = value
+
+    def getLocalizedString(self, id):
+        return str(id)
+
+    def openSettings(self):
+        pass
+
+
+class Monitor(object):
+    def __init__(self):
+        monitors.append(self)
+
+    def onSettingsChanged(self):
+        pass
+
+    def waitForAbort(self, timeout=None):
+        return abort_event.wait(timeout)
+
+    def abortRequested(self):
+        return abort_event.is_set()
+
+
+class Player(object):
+    def isPlaying(self):
+        return False
+
+    def getPlayingFile(self):
+        return ''
+
+    def play(self, item=None, listitem=None, windowed=False):
+        pass
+
+    def stop(self):
+        pass
+
+
+class _Control(object):
+    def __new__(cls, *args, **kwargs):
+        return object.__new__(cls)
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class ControlImage(_Control):
+    def setImage(self, filename, useCache=True):
+        shown_images.append((time.time(), filename))
+
+
+class _Window(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class Dialog(_Window):
+    def yesno(self, *args, **kwargs):
+        return True
+
+
+def change_settings(values):
+    ''' Changes settings and notifies every monitor, as Kodi does when the settings dialog is closed '''
+    Addon.settings.update(values)
+    for monitor in monitors:
+        monitor.onSettingsChanged()
+
+
+def _log(message, level=0):
+    log_messages.append(message)
+    if os.environ.get('KODI_STUBS_LOG'):
+        sys.stderr.write("{0}\n".format(message))
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install(settings=None, profile=None):
+    ''' Installs the stand-in modules and returns the addon settings, which can still be changed '''
+    Addon.settings = default_settings()
+    Addon.settings.update(settings or {})
+    Addon.profile = profile or tempfile.mkdtemp(prefix="kodi-profile-")
+
+    _module('xbmc',
+            LOGDEBUG=0, LOGINFO=1, LOGNOTICE=2, LOGWARNING=3, LOGERROR=4,
+            log=_log,
+            sleep=lambda milliseconds: time.sleep(milliseconds / 1000.0),
+            translatePath=lambda path: path,
+            executebuiltin=lambda command: None,
+            getInfoLabel=lambda label: '',
+            Monitor=Monitor,
+            Player=Player)
+    _module('xbmcaddon', Addon=Addon)
+    _module('xbmcgui',
+            WindowDialog=_Window, WindowXMLDialog=_Window, Dialog=Dialog,
+            ControlImage=ControlImage, ControlButton=_Control, ControlRadioButton=_Control,
+            ControlLabel=_Control, ListItem=_Control)
+    return Addon.settings
@@ -0,0 +1,334 @@
+''' A local stand-in for a Foscam camera, for measuring the addon without hardware.
+
+    Serves CGIProxy.fcgi commands with XML responses and CGIStream.cgi with an MJPEG
+    stream, with configurable latency, jitter, frame size, frame rate and injected errors.
+
+    python tools/mock_camera.py --port 8088 --latency 0.05 --jitter 0.02 --error-rate 0.01 '''
+
+import argparse
+import base64
+import random
+import socket
+import sys
+import threading
+import time
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+
+BOUNDARY = 'ipcamera'
+ALARM_DURATION = 60
+# How long stop() waits for the connections it closes to be finished
+STOP_TIMEOUT = 5
+
+# Motion and sound alarm states as reported by getDevState
+NO_ALARM = 1
+ALARM = 2
+
+ERRORS = ('http', 'cgi', 'drop')
+
+CONFIGS = {
+    'getDevState': [('IOAlarm', 0), ('motionDetectAlarm', NO_ALARM), ('soundAlarm', NO_ALARM),
+                    ('record', 0), ('sdState', 0), ('ntpState', 1), ('infraLedState', 0)],
+    'getDevInfo': [('productName', 'FI9821W'), ('serialNo', '0000000000000001'),
+                   ('devName', 'Mock'), ('firmwareVer', '1.11.1.18'), ('hardwareVer', '1.4.1.10')],
+    'getMotionDetectConfig': ([('isEnable', 1), ('linkage', 0), ('snapInterval', 1),
+                               ('sensitivity', 1), ('triggerInterval', 15)] +
+                              [('schedule{0}'.format(i), 281474976710655) for i in range(7)] +
+                              [('area{0}'.format(i), 1023) for i in range(10)]),
+    'getAudioAlarmConfig': [('isEnable', 1), ('linkage', 0), ('snapInterval', 1),
+                            ('sensitivity', 1), ('triggerInterval', 15)] +
+                           [('schedule{0}'.format(i), 281474976710655) for i in range(7)],
+    'getSnapConfig': [('snapPicQuality', 0), ('saveLocation', 2)],
+    'getMirrorAndFlipSetting': [('isMirror', 0), ('isFlip', 0)],
+    'getSubVideoStreamParam': [('resolution', 2), ('bitRate', 524288), ('frameRate', 15),
+                               ('GOP', 30), ('isVBR', 0)],
+}
+
+# Commands which change a value of a config without a matching get command
+SETTERS = {
+    'mirrorVideo': ('getMirrorAndFlipSetting', 'isMirror', 'isMirror'),
+    'flipVideo': ('getMirrorAndFlipSetting', 'isFlip', 'isFlip'),
+    'openInfraLed': ('getDevState', 'infraLedState', None),
+    'closeInfraLed': ('getDevState', 'infraLedState', None),
+}
+
+COMMANDS = ('setSubStreamFormat', 'ptzMoveUp', 'ptzMoveDown', 'ptzMoveLeft', 'ptzMoveRight',
+            'ptzMoveTopLeft', 'ptzMoveTopRight', 'ptzMoveBottomLeft', 'ptzMoveBottomRight',
+            'ptzStopRun', 'ptzReset')
+
+
+def jpeg(size, seed=0):
+    ''' Returns a frame of the given size which starts and ends like a JPEG image '''
+    body = bytearray((seed + i) % 251 for i in range(max(0, size - 4)))
+    return b'\xff\xd8' + bytes(body) + b'\xff\xd9'
+
+
+def cgi_result(result, values=()):
+    lines = ["<CGI_Result>", "    <result>{0}</result>".format(result)]
+    lines.extend("    <{0}>{1}</{0}>".format(key, value) for key, value in values)
+    lines.append("</CGI_Result>\n")
+    return "\n".join(lines).encode('utf-8')
+
+
+class _CameraRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        params.update(self.basic_auth())
+        camera = self.server
+        camera.delay()
+
+        error = camera.error()
+        if error == 'drop':
+            self.close_connection = True
+            return
+        if error == 'http':
+            self.send_body(500, 'text/plain', b"Internal error\n")
+            return
+
+        if url.path.endswith('/CGIStream.cgi'):
+            if not camera.authorised(params):
+                self.send_body(401, 'text/plain', b"Unauthorised\n")
+            else:
+                self.send_stream()
+        elif url.path.endswith('/CGIProxy.fcgi'):
+            if error == 'cgi':
+                self.send_body(200, 'text/xml', cgi_result(-4))
+            elif params.get('cmd') == 'snapPicture2' and camera.authorised(params):
+                self.send_body(200, 'image/jpeg', camera.frame())
+            else:
+                self.send_body(200, 'text/xml', camera.command(params))
+        else:
+            self.send_body(404, 'text/plain', b"Not found\n")
+
+    def basic_auth(self):
+        ''' Returns the credentials given in an Authorization header as usr and pwd parameters '''
+        authorization = self.headers.get('Authorization', '')
+        if not authorization.startswith('Basic '):
+            return {}
+        user, _, password = base64.b64decode(authorization[6:].encode('ascii')).decode('utf-8').partition(':')
+        return {'usr': user, 'pwd': password}
+
+    def send_body(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self):
+        camera = self.server
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'multipart/x-mixed-replace;boundary={0}'.format(BOUNDARY))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        next_frame = time.time()
+        while not camera.stopped:
+            frame = camera.frame()
+            if camera.error():
+                frame = frame[:len(frame) // 2]
+            header = "--{0}\r\nContent-Type: image/jpeg\r\nContent-Length: {1}\r\n\r\n".format(
+                BOUNDARY, len(frame)).encode('ascii')
+            try:
+                self.wfile.write(header + frame + b"\r\n")
+                self.wfile.flush()
+            except (IOError, OSError):
+                break
+            camera.stream_frames += 1
+
+            if camera.fps:
+                next_frame += camera.jittered(1.0 / camera.fps)
+                time.sleep(max(0, next_frame - time.time()))
+
+    def log_message(self, format, *args):
+        self.server.log("{0} {1}".format(self.client_address[0], format % args))
+
+
+class MockCamera(ThreadingMixIn, HTTPServer):
+    ''' An HTTP server which answers like a Foscam camera.
+
+        latency and jitter delay every response, in seconds. The stream is sent at fps
+        frames a second, or as fast as possible if fps is 0. error_rate is the chance of
+        a request failing or a streamed frame being cut short. '''
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, host='127.0.0.1', user='admin', password='',
+                 latency=0, jitter=0, frame_size=30000, fps=15, error_rate=0, seed=None,
+                 log=None):
+        HTTPServer.__init__(self, (host, port), _CameraRequestHandler)
+        self.user = user
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.fps = fps
+        self.error_rate = error_rate
+        self.log = log or (lambda message: None)
+
+        self.configs = dict((cmd, list(values)) for cmd, values in CONFIGS.items())
+        self.frames = [jpeg(frame_size, seed) for seed in range(4)]
+        self.commands = {}
+        self.stream_frames = 0
+        self.stopped = False
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._connections_changed = threading.Condition()
+        self._frame = 0
+        self._alarm_until = 0
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-camera")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        ''' Stops serving and closes the open connections, so that no request thread is
+            left running when the interpreter exits '''
+        self.stopped = True
+        self.shutdown()
+        self.server_close()
+        with self._connections_changed:
+            for connection in self._connections:
+                try:
+                    connection.shutdown(socket.SHUT_RDWR)
+                except (socket.error, IOError):
+                    pass
+            deadline = time.time() + STOP_TIMEOUT
+            while self._connections and time.time() < deadline:
+                self._connections_changed.wait(deadline - time.time())
+
+    def process_request(self, request, client_address):
+        with self._connections_changed:
+            self._connections.add(request)
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        HTTPServer.shutdown_request(self, request)
+        with self._connections_changed:
+            self._connections.discard(request)
+            self._connections_changed.notify_all()
+
+    def handle_error(self, request, client_address):
+        # Clients close the stream when they have read enough, which is not an error,
+        # and requests still running when the camera stops may fail in any way
+        if self.stopped or isinstance(sys.exc_info()[1], (socket.error, IOError)):
+            return
+        HTTPServer.handle_error(self, request, client_address)
+
+    def trigger_alarm(self, duration=ALARM_DURATION):
+        ''' Raises a motion alarm which getDevState reports for the given number of seconds '''
+        with self._lock:
+            self._alarm_until = time.time() + duration
+
+    def jittered(self, value):
+        with self._lock:
+            return max(0, value + self._random.uniform(-self.jitter, self.jitter))
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.jittered(self.latency))
+
+    def error(self):
+        with self._lock:
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self._random.choice(ERRORS)
+        return None
+
+    def frame(self):
+        with self._lock:
+            self._frame = (self._frame + 1) % len(self.frames)
+            return self.frames[self._frame]
+
+    def authorised(self, params):
+        return params.get('usr') == self.user and params.get('pwd', '') == self.password
+
+    def command(self, params):
+        cmd = params.pop('cmd', None)
+        with self._lock:
+            self.commands[cmd] = self.commands.get(cmd, 0) + 1
+            if not self.authorised(params):
+                return cgi_result(-2)
+            params.pop('usr', None)
+            params.pop('pwd', None)
+
+            if cmd == 'getDevState':
+                state = ALARM if time.time() < self._alarm_until else NO_ALARM
+                values = [(key, state if key == 'motionDetectAlarm' else value)
+                          for key, value in self.configs[cmd]]
+                return cgi_result(0, values)
+            if cmd in self.configs:
+                return cgi_result(0, self.configs[cmd])
+
+            get_cmd = cmd.replace('set', 'get', 1) if cmd else None
+            if get_cmd in self.configs:
+                self._update(get_cmd, params)
+                return cgi_result(0)
+            if cmd in SETTERS:
+                get_cmd, key, param = SETTERS[cmd]
+                value = params.get(param) if param else int(cmd.startswith('open'))
+                self._update(get_cmd, {key: value})
+                return cgi_result(0)
+            if cmd in COMMANDS:
+                return cgi_result(0)
+        return cgi_result(-1)
+
+    def _update(self, get_cmd, params):
+        self.configs[get_cmd] = [(key, params.get(key, value)) for key, value in self.configs[get_cmd]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8088)
+    parser.add_argument('--user', default='admin')
+    parser.add_argument('--password', default='')
+    parser.add_argument('--latency', type=float, default=0, help="response delay in seconds")
+    parser.add_argument('--jitter', type=float, default=0, help="random variation of the delay in seconds")
+    parser.add_argument('--frame-size', type=int, default=30000, help="bytes per streamed frame")
+    parser.add_argument('--fps', type=float, default=15, help="stream frame rate, 0 for unlimited")
+    parser.add_argument('--error-rate', type=float, default=0, help="chance of a request failing")
+    parser.add_argument('--alarm-every', type=float, default=0, help="raise a motion alarm every so many seconds")
+    args = parser.parse_args()
+
+    def log(message):
+        print(message)
+
+    camera = MockCamera(args.port, args.host, args.user, args.password, args.latency, args.jitter,
+                        args.frame_size, args.fps, args.error_rate, log=log)
+    camera.start()
+    print("Mock camera on http://{0}:{1}".format(args.host, camera.port))
+    try:
+        while True:
+            if args.alarm_every:
+                time.sleep(args.alarm_every)
+                print("Raising motion alarm")
+                camera.trigger_alarm()
+            else:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        camera.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+''' Stands in for a camera sending an alarm notification to the service's alarm listener.
+
+    python tools/send_alarm.py localhost:8089 --camera 2 '''
+
+import argparse
+
+try:
+    from urllib2 import urlopen, HTTPError
+    from urllib import urlencode
+except ImportError:
+    from urllib.request import urlopen
+    from urllib.error import HTTPError
+    from urllib.parse import urlencode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('address', help="host:port of the alarm listener")
+    parser.add_argument('--camera', help="camera number, otherwise identified by address")
+    args = parser.parse_args()
+
+    url = "http://{0}/alarm".format(args.address)
+    if args.camera:
+        url += "?" + urlencode({'camera': args.camera})
+
+    try:
+        response = urlopen(url, timeout=5)
+    except HTTPError as e:
+        response = e
+    print("{0} {1}".format(response.getcode(), response.read().decode('ascii').strip()))
+
+
+if __name__ == "__main__":
+    main()